@@ -24,10 +24,12 @@ from tensorflow.keras.regularizers import l2
 from tensorflow.keras import backend as K
 from tensorflow.keras.optimizers import SGD
 import warnings
+from precision import with_precision_policy
 
 warnings.filterwarnings("ignore")
 
 
+@with_precision_policy
 def basemodel(weight_decay):
     # 2 hidden layers
     model_input = Input(
@@ -49,11 +51,14 @@ def basemodel(weight_decay):
     model = MaxPooling2D(pool_size=(2, 2))(model)
     model = BatchNormalization()(model)
     model = Flatten()(model)
-    model = Dense(4, kernel_regularizer=l2(weight_decay), activation="softmax")(model)
+    model = Dense(
+        4, kernel_regularizer=l2(weight_decay), activation="softmax", dtype="float32"
+    )(model)
     model = Model(inputs=model_input, outputs=model)
     return model
 
 
+@with_precision_policy
 def model_2(weight_decay):
     model_input = Input(
         shape=(
@@ -79,11 +84,14 @@ def model_2(weight_decay):
     model = MaxPooling2D(pool_size=(2, 2))(model)
     model = BatchNormalization()(model)
     model = Flatten()(model)
-    model = Dense(4, kernel_regularizer=l2(weight_decay), activation="softmax")(model)
+    model = Dense(
+        4, kernel_regularizer=l2(weight_decay), activation="softmax", dtype="float32"
+    )(model)
     model = Model(inputs=model_input, outputs=model)
     return model
 
 
+@with_precision_policy
 def model_3(weight_decay):
     # 4 hidden layers
     model_input = Input(
@@ -115,6 +123,8 @@ def model_3(weight_decay):
     model = MaxPooling2D(pool_size=(2, 2))(model)
     model = BatchNormalization()(model)
     model = Flatten()(model)
-    model = Dense(4, kernel_regularizer=l2(weight_decay), activation="softmax")(model)
+    model = Dense(
+        4, kernel_regularizer=l2(weight_decay), activation="softmax", dtype="float32"
+    )(model)
     model = Model(inputs=model_input, outputs=model)
     return model
@@ -24,11 +24,13 @@ from tensorflow.keras.regularizers import l2
 from tensorflow.keras import backend as K
 from tensorflow.keras.optimizers import SGD
 import warnings
+from precision import with_precision_policy
 from constraint import tight_frame
 
 warnings.filterwarnings("ignore")
 
 
+@with_precision_policy
 def model_parseval(weight_decay):
 
     model_input = Input(
@@ -78,6 +80,8 @@ def model_parseval(weight_decay):
     model = MaxPooling2D(pool_size=(2, 2))(model)
     model = BatchNormalization()(model)
     model = Flatten()(model)
-    model = Dense(4, activation="softmax", kernel_regularizer=l2(weight_decay))(model)
+    model = Dense(
+        4, activation="softmax", kernel_regularizer=l2(weight_decay), dtype="float32"
+    )(model)
     model = Model(inputs=model_input, outputs=model)
     return model
@@ -0,0 +1,71 @@
+import time
+
+import tensorflow as tf
+
+from constraint import TightFrame
+
+STEPS = 200
+# standard deviation of the simulated gradient step
+NOISE = 1e-3
+
+# (name, keyword arguments of TightFrame)
+VARIANTS = [
+    ("full", {}),
+    ("sample 0.5", {"sample_rate": 0.5}),
+    ("sample 0.25", {"sample_rate": 0.25}),
+    ("every 2", {"retraction_period": 2}),
+    ("every 4", {"retraction_period": 4}),
+    ("sample 0.5 every 2", {"sample_rate": 0.5, "retraction_period": 2}),
+]
+
+
+def orthogonality_error(w):
+    """returns ||W^T W - I||_F / sqrt(n) of the unfolded weights"""
+    w_reordered = tf.reshape(w, (-1, w.shape[-1]))
+    gram = tf.matmul(w_reordered, w_reordered, transpose_a=True)
+    identity = tf.eye(w.shape[-1])
+    return float(tf.norm(gram - identity) / tf.sqrt(float(w.shape[-1])))
+
+
+def benchmark(shape, constraint, steps=STEPS):
+    """[summary]
+
+    Args:
+        shape (tuple): kernel shape of the convolution
+        constraint (TightFrame): constraint under test
+        steps (int, optional): simulated optimizer steps. Defaults to STEPS.
+
+    Returns:
+        mean milliseconds per step and orthogonality error after the steps
+    """
+    tf.random.set_seed(0)
+    w = tf.Variable(tf.keras.initializers.Orthogonal(seed=0)(shape))
+
+    @tf.function
+    def step():
+        w.assign(constraint(w + tf.random.normal(shape, stddev=NOISE)))
+
+    step()
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    elapsed = time.perf_counter() - start
+
+    return 1000 * elapsed / steps, orthogonality_error(w)
+
+
+if __name__ == "__main__":
+
+    # widest convolution of the conv3 blocks of ParsevalNetwork(k=4) and (k=8)
+    for k in (4, 8):
+        shape = (3, 3, 64 * k, 64 * k)
+        print("kernel {}".format(shape))
+        full_ms = None
+        for name, kwargs in VARIANTS:
+            step_ms, error = benchmark(shape, TightFrame(0.001, **kwargs))
+            full_ms = full_ms or step_ms
+            print(
+                "{:>20}: {:8.3f} ms/step ({:4.2f}x) orthogonality error {:.2e}".format(
+                    name, step_ms, full_ms / step_ms, error
+                )
+            )
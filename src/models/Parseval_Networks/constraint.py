@@ -1,5 +1,7 @@
 from tensorflow.python.keras.constraints import Constraint
 from tensorflow.python.ops import math_ops, array_ops
+from tensorflow.python.ops import control_flow_ops, random_ops, variables
+from tensorflow.python.framework import dtypes
 
 
 class TightFrame(Constraint):
@@ -12,7 +14,8 @@ class TightFrame(Constraint):
 
     Warning: This constraint simply performs the update step on the weight matrix
     (or the unfolded weight matrix for convolutional layers). Thus, it does not
-    handle the necessary scalings for convolutional layers.
+    handle the necessary scalings for convolutional layers. The kernels stay
+    float32 under the mixed_bfloat16 policy, so the retraction is float32 too.
 
     Args:
         scale (float):    Retraction parameter (length of retraction step).
@@ -22,12 +25,17 @@ class TightFrame(Constraint):
         Weight matrix after applying regularizer.
     """
 
-    def __init__(self, scale, num_passes=1):
+    def __init__(self, scale, num_passes=1, sample_rate=1.0, retraction_period=1):
         """[summary]
 
         Args:
             scale ([type]): [description]
             num_passes (int, optional): [description]. Defaults to 1.
+            sample_rate (float, optional): fraction of the rows (output channels)
+                which are retracted at every call, as in the Parseval paper.
+                Defaults to 1.0, the full retraction.
+            retraction_period (int, optional): retract every n-th call only, the
+                other calls return the weights unchanged. Defaults to 1.
 
         Raises:
             ValueError: [description]
@@ -38,7 +46,24 @@ class TightFrame(Constraint):
             raise ValueError(
                 "Number of passes cannot be non-positive! (got {})".format(num_passes)
             )
+        if not 0.0 < sample_rate <= 1.0:
+            raise ValueError(
+                "Sample rate must be in (0, 1]! (got {})".format(sample_rate)
+            )
+        if retraction_period < 1:
+            raise ValueError(
+                "Retraction period cannot be non-positive! (got {})".format(
+                    retraction_period
+                )
+            )
         self.num_passes = num_passes
+        self.sample_rate = sample_rate
+        self.retraction_period = retraction_period
+        self.step = None
+        if retraction_period > 1:
+            self.step = variables.Variable(
+                0, dtype=dtypes.int64, trainable=False, name="tight_frame_step"
+            )
 
     def __call__(self, w):
         """[summary]
@@ -49,6 +74,25 @@ class TightFrame(Constraint):
         Returns:
             [type]: returns new weights
         """
+        if self.step is None:
+            return self.retract(w)
+
+        step = self.step.assign_add(1)
+        return control_flow_ops.cond(
+            math_ops.equal(step % self.retraction_period, 0),
+            lambda: self.retract(w),
+            lambda: array_ops.identity(w),
+        )
+
+    def retract(self, w):
+        """[summary]
+
+        Args:
+            w ([type]): weight of conv or linear layers
+
+        Returns:
+            [type]: weights after num_passes retraction steps
+        """
         transpose_channels = len(w.shape) == 4
 
         # Move channels_num to the front in order to make the dimensions correct for matmul
@@ -58,6 +102,18 @@ class TightFrame(Constraint):
         else:
             w_reordered = w
 
+        if self.sample_rate < 1.0:
+            last = self.sampled_retraction(w_reordered)
+        else:
+            last = self.full_retraction(w_reordered)
+
+        # Move channels_num to the back again
+        if transpose_channels:
+            return array_ops.reshape(last, w.shape)
+        else:
+            return last
+
+    def full_retraction(self, w_reordered):
         last = w_reordered
         for i in range(self.num_passes):
             temp1 = math_ops.matmul(last, last, transpose_a=True)
@@ -67,14 +123,34 @@ class TightFrame(Constraint):
 
             last = temp2
 
-        # Move channels_num to the back again
-        if transpose_channels:
-            return array_ops.reshape(last, w.shape)
-        else:
-            return last
+        return last
+
+    def sampled_retraction(self, w_reordered):
+        """retracts a random subset of the rows only, which costs sample_rate**2 of
+        the full retraction. The other rows are left unchanged.
+        """
+        rows = int(w_reordered.shape[1])
+        num_sampled = max(1, int(round(rows * self.sample_rate)))
+        index = random_ops.random_shuffle(math_ops.range(rows))[:num_sampled]
+
+        w_sampled = array_ops.gather(w_reordered, index, axis=1)
+        w_sampled = self.full_retraction(w_sampled)
+
+        # rows are the columns of the reordered weights, scatter along the first axis
+        w_updated = array_ops.tensor_scatter_nd_update(
+            array_ops.transpose(w_reordered),
+            array_ops.expand_dims(index, 1),
+            array_ops.transpose(w_sampled),
+        )
+        return array_ops.transpose(w_updated)
 
     def get_config(self):
-        return {"scale": self.scale, "num_passes": self.num_passes}
+        return {
+            "scale": self.scale,
+            "num_passes": self.num_passes,
+            "sample_rate": self.sample_rate,
+            "retraction_period": self.retraction_period,
+        }
 
 
 # Alias
@@ -49,5 +49,6 @@ def convex_add(input_layer, layer_3, initial_convex_par=0.5, trainable=False):
         initial_value=initial_p_value, dtype=dtypes.float32, trainable=trainable
     )
 
-    lam = math_ops.sigmoid(p)
+    # p stays float32, lam takes the compute dtype of the inputs (e.g. bfloat16)
+    lam = math_ops.cast(math_ops.sigmoid(p), input_layer.dtype)
     return input_layer * lam + (1 - lam) * layer_3
@@ -5,9 +5,11 @@ from tensorflow.keras.layers import BatchNormalization
 from tensorflow.keras.regularizers import l2
 from tensorflow.keras import backend as K
 from tensorflow.keras.optimizers import SGD
+import fnmatch
 import warnings
 from constraint import tight_frame
 from convexity_constraint import convex_add
+from precision import precision_policy
 
 warnings.filterwarnings("ignore")
 
@@ -23,6 +25,9 @@ class ParsevalNetwork(Model):
         k=1,
         dropout=0.0,
         verbose=1,
+        tight_frame_config=None,
+        mixed_precision=False,
+        layer_tight_frame_config=None,
     ):
         """[Assign the initial parameters of the wide residual network]
 
@@ -34,6 +39,18 @@ class ParsevalNetwork(Model):
             k (int, optional): [network width]. Defaults to 1.
             dropout (float, optional): [dropout value to prevent overfitting]. Defaults to 0.0.
             verbose (int, optional): [description]. Defaults to 1.
+            tight_frame_config (dict, optional): keyword arguments of the TightFrame
+                constraint of the convolutions, e.g. sample_rate or
+                retraction_period. Defaults to None, the full retraction.
+            layer_tight_frame_config (dict, optional): {layer name pattern:
+                keyword arguments} which override tight_frame_config for the
+                matching convolutions, e.g. {"conv3_block*": {"sample_rate": 0.5}}.
+                The convolutions are named initial_conv, expand<base>_conv1,
+                expand<base>_conv2, expand<base>_skip and conv<stage>_block<i>_conv1,
+                conv<stage>_block<i>_conv2. Defaults to None.
+            mixed_precision (bool, optional): run the convolutions in bfloat16, the
+                softmax, the convex combination parameters and the TightFrame
+                retraction stay float32. Defaults to False.
 
         Returns:
             [Model]: [parsevalnetwork]
@@ -45,6 +62,22 @@ class ParsevalNetwork(Model):
         self.k = k
         self.dropout = dropout
         self.verbose = verbose
+        self.tight_frame_config = tight_frame_config or {}
+        self.layer_tight_frame_config = layer_tight_frame_config or {}
+        self.mixed_precision = mixed_precision
+
+    def tight_frame(self, name):
+        """returns a new TightFrame constraint for the convolution of a layer name
+
+        The keyword arguments are tight_frame_config, updated by the entries of
+        layer_tight_frame_config whose pattern matches the name, in order.
+        Override it to configure the layers in another way.
+        """
+        config = dict(self.tight_frame_config)
+        for pattern, layer_config in self.layer_tight_frame_config.items():
+            if fnmatch.fnmatchcase(name, pattern):
+                config.update(layer_config)
+        return tight_frame(0.001, **config)
 
     def initial_conv(self, input):
         """[summary]
@@ -61,7 +94,8 @@ class ParsevalNetwork(Model):
             padding="same",
             kernel_initializer="orthogonal",
             kernel_regularizer=l2(self.weight_decay),
-            kernel_constraint=tight_frame(0.001),
+            name="initial_conv",
+            kernel_constraint=self.tight_frame("initial_conv"),
             use_bias=False,
         )(input)
 
@@ -85,6 +119,7 @@ class ParsevalNetwork(Model):
         Returns:
             [type]: [description]
         """
+        prefix = "expand{}".format(base)
         x = Convolution2D(
             base * k,
             (3, 3),
@@ -92,7 +127,8 @@ class ParsevalNetwork(Model):
             strides=strides,
             kernel_initializer="Orthogonal",
             kernel_regularizer=l2(self.weight_decay),
-            kernel_constraint=tight_frame(0.001),
+            name=prefix + "_conv1",
+            kernel_constraint=self.tight_frame(prefix + "_conv1"),
             use_bias=False,
         )(init)
 
@@ -109,7 +145,8 @@ class ParsevalNetwork(Model):
             padding="same",
             kernel_initializer="Orthogonal",
             kernel_regularizer=l2(self.weight_decay),
-            kernel_constraint=tight_frame(0.001),
+            name=prefix + "_conv2",
+            kernel_constraint=self.tight_frame(prefix + "_conv2"),
             use_bias=False,
         )(x)
 
@@ -120,7 +157,8 @@ class ParsevalNetwork(Model):
             strides=strides,
             kernel_initializer="Orthogonal",
             kernel_regularizer=l2(self.weight_decay),
-            kernel_constraint=tight_frame(0.001),
+            name=prefix + "_skip",
+            kernel_constraint=self.tight_frame(prefix + "_skip"),
             use_bias=False,
         )(init)
 
@@ -128,7 +166,7 @@ class ParsevalNetwork(Model):
 
         return m
 
-    def conv1_block(self, input, k=1, dropout=0.0):
+    def conv1_block(self, input, k=1, dropout=0.0, block=0):
         """[summary]
 
         Args:
@@ -140,6 +178,7 @@ class ParsevalNetwork(Model):
             [type]: [description]
         """
         init = input
+        prefix = "conv1_block{}".format(block)
 
         channel_axis = 1 if K.image_data_format() == "channels_first" else -1
 
@@ -153,7 +192,8 @@ class ParsevalNetwork(Model):
             padding="same",
             kernel_initializer="Orthogonal",
             kernel_regularizer=l2(self.weight_decay),
-            kernel_constraint=tight_frame(0.001),
+            name=prefix + "_conv1",
+            kernel_constraint=self.tight_frame(prefix + "_conv1"),
             use_bias=False,
         )(x)
 
@@ -170,13 +210,14 @@ class ParsevalNetwork(Model):
             padding="same",
             kernel_initializer="Orthogonal",
             kernel_regularizer=l2(self.weight_decay),
-            kernel_constraint=tight_frame(0.001),
+            name=prefix + "_conv2",
+            kernel_constraint=self.tight_frame(prefix + "_conv2"),
             use_bias=False,
         )(x)
         m = convex_add(init, x, initial_convex_par=0.5, trainable=True)
         return m
 
-    def conv2_block(self, input, k=1, dropout=0.0):
+    def conv2_block(self, input, k=1, dropout=0.0, block=0):
         """[summary]
 
         Args:
@@ -188,6 +229,7 @@ class ParsevalNetwork(Model):
             [type]: [description]
         """
         init = input
+        prefix = "conv2_block{}".format(block)
 
         channel_axis = 1 if K.image_data_format() == "channels_first" else -1
         x = BatchNormalization(
@@ -200,7 +242,8 @@ class ParsevalNetwork(Model):
             padding="same",
             kernel_initializer="Orthogonal",
             kernel_regularizer=l2(self.weight_decay),
-            kernel_constraint=tight_frame(0.001),
+            name=prefix + "_conv1",
+            kernel_constraint=self.tight_frame(prefix + "_conv1"),
             use_bias=False,
         )(x)
 
@@ -217,15 +260,17 @@ class ParsevalNetwork(Model):
             padding="same",
             kernel_initializer="Orthogonal",
             kernel_regularizer=l2(self.weight_decay),
-            kernel_constraint=tight_frame(0.001),
+            name=prefix + "_conv2",
+            kernel_constraint=self.tight_frame(prefix + "_conv2"),
             use_bias=False,
         )(x)
 
         m = convex_add(init, x, initial_convex_par=0.5, trainable=True)
         return m
 
-    def conv3_block(self, input, k=1, dropout=0.0):
+    def conv3_block(self, input, k=1, dropout=0.0, block=0):
         init = input
+        prefix = "conv3_block{}".format(block)
 
         channel_axis = 1 if K.image_data_format() == "channels_first" else -1
         x = BatchNormalization(
@@ -237,7 +282,8 @@ class ParsevalNetwork(Model):
             (3, 3),
             padding="same",
             kernel_initializer="Orthogonal",
-            kernel_constraint=tight_frame(0.001),
+            name=prefix + "_conv1",
+            kernel_constraint=self.tight_frame(prefix + "_conv1"),
             kernel_regularizer=l2(self.weight_decay),
             use_bias=False,
         )(x)
@@ -254,7 +300,8 @@ class ParsevalNetwork(Model):
             (3, 3),
             padding="same",
             kernel_initializer="Orthogonal",
-            kernel_constraint=tight_frame(0.001),
+            name=prefix + "_conv2",
+            kernel_constraint=self.tight_frame(prefix + "_conv2"),
             kernel_regularizer=l2(self.weight_decay),
             use_bias=False,
         )(x)
@@ -269,6 +316,10 @@ class ParsevalNetwork(Model):
         Returns:
             [Model]: [wide residual network]
         """
+        with precision_policy(self.mixed_precision):
+            return self.build_wide_residual_network()
+
+    def build_wide_residual_network(self):
         channel_axis = 1 if K.image_data_format() == "channels_first" else -1
 
         ip = Input(shape=self.input_dim)
@@ -280,7 +331,7 @@ class ParsevalNetwork(Model):
         nb_conv += 2
 
         for i in range(self.N - 1):
-            x = self.conv1_block(x, self.k, self.dropout)
+            x = self.conv1_block(x, self.k, self.dropout, block=i)
             nb_conv += 2
 
         x = BatchNormalization(
@@ -292,7 +343,7 @@ class ParsevalNetwork(Model):
         nb_conv += 2
 
         for i in range(self.N - 1):
-            x = self.conv2_block(x, self.k, self.dropout)
+            x = self.conv2_block(x, self.k, self.dropout, block=i)
             nb_conv += 2
 
         x = BatchNormalization(
@@ -304,7 +355,7 @@ class ParsevalNetwork(Model):
         nb_conv += 2
 
         for i in range(self.N - 1):
-            x = self.conv3_block(x, self.k, self.dropout)
+            x = self.conv3_block(x, self.k, self.dropout, block=i)
             nb_conv += 2
 
         x = BatchNormalization(
@@ -319,6 +370,7 @@ class ParsevalNetwork(Model):
             self.nb_classes,
             kernel_regularizer=l2(self.weight_decay),
             activation="softmax",
+            dtype="float32",
         )(x)
 
         model = Model(ip, x)
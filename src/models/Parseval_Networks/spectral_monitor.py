@@ -0,0 +1,147 @@
+import csv
+import os
+
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback
+
+from constraint import TightFrame
+
+FIELDS = ["epoch", "batch", "layer", "spectral_norm", "orthogonality_error"]
+
+
+class OrthogonalityMonitor(Callback):
+    """
+    Streams an estimate of the spectral norm and of ||W^T W - I||_2 of every layer
+    with a TightFrame constraint to a csv file during training.
+
+    The values come from two power iterations on the unfolded kernel W, one on
+    W^T W for the spectral norm and one on W^T W - I for the error. Their vectors
+    are kept between measurements and warm-start the next ones, so that a few
+    iterations per measurement follow the slowly changing weights closely. The
+    steps alternate between the two iterations, so with n_iter=1 a measurement
+    costs one W^T W-vector product, two matrix-vector products, per layer, and
+    each value is refreshed every second measurement.
+
+    Args:
+        filename (str): csv file, rows are appended
+        every_n_batches (int, optional): also measure every n batches. Defaults to
+            None, at the end of every epoch only.
+        n_iter (int, optional): power iterations per measurement. Defaults to 1.
+        all_layers (bool, optional): monitor every layer with a kernel, not only
+            the constrained ones. Defaults to False.
+    """
+
+    def __init__(self, filename, every_n_batches=None, n_iter=1, all_layers=False):
+        super(OrthogonalityMonitor, self).__init__()
+        self.filename = filename
+        self.every_n_batches = every_n_batches
+        self.n_iter = n_iter
+        self.all_layers = all_layers
+        self.epoch = 0
+        self.layers = []
+        # warm-started iteration vectors and last estimates of the layers
+        self.state = {}
+
+    def on_train_begin(self, logs=None):
+        self.layers = [
+            layer
+            for layer in self.model.layers
+            if hasattr(layer, "kernel")
+            and (
+                self.all_layers
+                or isinstance(getattr(layer, "kernel_constraint", None), TightFrame)
+            )
+        ]
+        write_header = not os.path.exists(self.filename)
+        self.file_ = open(self.filename, "a", newline="")
+        self.writer = csv.DictWriter(self.file_, fieldnames=FIELDS)
+        if write_header:
+            self.writer.writeheader()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.every_n_batches and (batch + 1) % self.every_n_batches == 0:
+            self.measure(batch + 1)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.measure(None)
+
+    def on_train_end(self, logs=None):
+        self.file_.close()
+
+    def measure(self, batch):
+        """writes one row per monitored layer"""
+        for layer in self.layers:
+            spectral_norm, orthogonality_error = self.estimate(layer)
+            self.writer.writerow(
+                {
+                    "epoch": self.epoch,
+                    "batch": "" if batch is None else batch,
+                    "layer": layer.name,
+                    "spectral_norm": spectral_norm,
+                    "orthogonality_error": orthogonality_error,
+                }
+            )
+        self.file_.flush()
+
+    def estimate(self, layer):
+        """[summary]
+
+        Args:
+            layer ([type]): layer with a kernel
+
+        Returns:
+            estimates of the largest singular value of the unfolded kernel W and of
+            the spectral norm of W^T W - I. The first measurement of a layer starts
+            both iterations, later steps alternate between them.
+        """
+        kernel = tf.convert_to_tensor(layer.kernel)
+        w = tf.reshape(kernel, (-1, kernel.shape[-1]))
+        size = int(w.shape[1])
+
+        def gram(v):
+            return tf.linalg.matvec(w, tf.linalg.matvec(w, v), transpose_a=True)
+
+        state = self.state.get(layer.name)
+        n_iter = self.n_iter
+        if state is None:
+            state = {
+                "v_norm": tf.math.l2_normalize(tf.random.normal((size,))),
+                "v_error": tf.math.l2_normalize(tf.random.normal((size,))),
+                "step": 0,
+            }
+            self.state[layer.name] = state
+            n_iter = max(2, n_iter)
+
+        for _ in range(n_iter):
+            if state["step"] % 2 == 0:
+                # eigenvalues of W^T W are the squared singular values of W
+                state["v_norm"], state["squared_norm"] = power_step(
+                    gram, state["v_norm"], 0.0
+                )
+            else:
+                state["v_error"], state["error"] = power_step(
+                    gram, state["v_error"], 1.0
+                )
+            state["step"] += 1
+
+        return state["squared_norm"] ** 0.5, state["error"]
+
+
+def power_step(gram, v, shift):
+    """[summary]
+
+    Args:
+        gram (callable): W^T W-vector product
+        v ([type]): unit iteration vector
+        shift (float): power iteration on W^T W - shift * I
+
+    Returns:
+        the next unit vector and ||(W^T W - shift * I) v||, which approaches the
+        largest absolute eigenvalue of W^T W - shift * I from below
+    """
+    a_v = gram(v) - shift * v
+    value = tf.norm(a_v)
+    return a_v / (value + 1e-12), float(value)
@@ -6,7 +6,21 @@ import cleverhans
 from cleverhans.tf2.attacks.fast_gradient_method import fast_gradient_method
 import tensorflow as tf
 
+import hashlib
 import numpy as np
+import weakref
+
+from prediction_cache import PredictionCache
+
+# images per gradient pass of the batched attacks
+ATTACK_BATCH_SIZE = 256
+
+# logits wrappers of the attacked models, dropped together with the model
+_logits_models = weakref.WeakKeyDictionary()
+
+# gradient signs of the attacked models, by the weights and the identity of the
+# input array
+_fgsm_sweeps = weakref.WeakKeyDictionary()
 
 
 def step_decay(epoch):
@@ -57,53 +71,439 @@ def step_decay_conv(epoch):
     return lrate
 
 
-def print_test(model, X_adv, X_test, y_test, epsilon):
+def print_test(
+    model, X_adv, X_test, y_test, epsilon, weights_path=None, cache=None, attack=None
+):
     """
     returns the test results and show the SNR and evaluation results
+    with the weights_path of the model, the predictions are read from the
+    PredictionCache, keyed by X_adv itself and the attack spec, which defaults
+    to {"name": "fgsm", "epsilon": epsilon}
     """
-    loss, acc = model.evaluate(X_adv, y_test)
+    if weights_path is None:
+        loss, acc = model.evaluate(X_adv, y_test)
+    else:
+        cache = cache or PredictionCache()
+        loss, acc = cache.evaluate(
+            lambda: model,
+            weights_path,
+            X_adv,
+            y_test,
+            attack or {"name": "fgsm", "epsilon": epsilon},
+        )
     print("epsilon: {} and test evaluation : {}, {}".format(epsilon, loss, acc))
+    X_test = np.reshape(X_test, np.shape(X_adv))
     SNR = 20 * np.log10(np.linalg.norm(X_test) / np.linalg.norm(X_test - X_adv))
     print("SNR: {}".format(SNR))
     return loss, acc
 
 
-def get_adversarial_examples(pretrained_model, X_true, y_true, epsilon):
+def get_logits_model(pretrained_model):
+    """returns the logits wrapper of a model, built once per model and reused
+
+    Args:
+        pretrained_model (Model): trained keras model
+
+    Returns:
+        logits_model (Model): model whose output is the last layer of the given model
     """
-    The attack requires the model to ouput the logits
-    returns the adversarial example/s of a given image/s for epsilon value using
-    fast gradient sign method
+    logits_model = _logits_models.get(pretrained_model)
+    if logits_model is None:
+        logits_model = tf.keras.Model(
+            pretrained_model.input, pretrained_model.layers[-1].output
+        )
+        _logits_models[pretrained_model] = logits_model
+    return logits_model
+
+
+def to_class_indices(y_true):
+    """turns one-hot labels into int64 class indices for the attacks
+
+    Args:
+        y_true (np.ndarray): one-hot labels or class indices
+
+    Returns:
+        labels (np.ndarray): class indices
     """
-    logits_model = tf.keras.Model(
-        pretrained_model.input, pretrained_model.layers[-1].output
-    )
-    X_adv = []
+    labels = np.asarray(y_true)
+    if labels.ndim > 1:
+        labels = np.argmax(labels, axis=-1)
+    return labels.astype("int64")
+
+
+def loss_for(y_true):
+    """returns the cross-entropy loss of one-hot labels or of class indices
+
+    Args:
+        y_true (np.ndarray): one-hot labels or class indices, e.g. int8
+
+    Returns:
+        loss (str): "categorical_crossentropy" or "sparse_categorical_crossentropy"
+    """
+    if np.ndim(y_true) == 1:
+        return "sparse_categorical_crossentropy"
+    return "categorical_crossentropy"
 
-    for i in range(len(X_true)):
 
-        random_index = i
+def fast_gradient_batches(
+    logits_model, X_true, y_true, epsilon, batch_size=ATTACK_BATCH_SIZE, out=None
+):
+    """runs fast gradient sign method on chunks of images, one gradient pass per chunk
 
-        original_image = X_true[random_index]
-        original_image = tf.convert_to_tensor(
-            original_image.reshape((1, 32, 32))
-        )  # The .reshape just gives it the proper form to input into the model, a batch of 1 a.k.a a tensor
-        original_label = y_true[random_index]
-        original_label = np.reshape(np.argmax(original_label), (1,)).astype("int64")
+    Args:
+        logits_model (Model): model which outputs the logits
+        X_true (np.ndarray): clean images
+        y_true (np.ndarray): one-hot labels or class indices
+        epsilon (float): perturbation size
+        batch_size (int, optional): images per gradient pass, bounds the memory.
+            Defaults to ATTACK_BATCH_SIZE.
+        out (np.ndarray, optional): preallocated float32 output array. Defaults to None.
 
-        adv_example_targeted_label = fast_gradient_method(
+    Returns:
+        out (np.ndarray): adversarial examples with the shape of X_true
+    """
+    input_shape = tuple(logits_model.input_shape[1:])
+    labels = to_class_indices(y_true)
+    if out is None:
+        out = np.empty((len(X_true),) + input_shape, dtype="float32")
+
+    for start in range(0, len(X_true), batch_size):
+        end = min(start + batch_size, len(X_true))
+        x_batch = np.asarray(X_true[start:end], dtype="float32").reshape(
+            (end - start,) + input_shape
+        )
+        adv_batch = fast_gradient_method(
             logits_model,
-            original_image,
+            tf.convert_to_tensor(x_batch),
             epsilon,
             np.inf,
-            y=original_label,
+            y=labels[start:end],
             targeted=False,
         )
-        X_adv.append(np.array(adv_example_targeted_label).reshape(32, 32, 1))
+        out[start:end] = adv_batch.numpy()
+
+    return out
+
+
+def get_adversarial_examples(
+    pretrained_model, X_true, y_true, epsilon, batch_size=ATTACK_BATCH_SIZE, out=None
+):
+    """
+    The attack requires the model to ouput the logits
+    returns the adversarial example/s of a given image/s for epsilon value using
+    fast gradient sign method, computed in chunks of batch_size images
+    """
+    logits_model = get_logits_model(pretrained_model)
+
+    return fast_gradient_batches(
+        logits_model, X_true, y_true, epsilon, batch_size=batch_size, out=out
+    )
+
+
+def projected_gradient_batches(
+    logits_model,
+    X_true,
+    y_true,
+    epsilon,
+    n_steps=10,
+    step_size=None,
+    random_start=True,
+    batch_size=ATTACK_BATCH_SIZE,
+    out=None,
+    seed=None,
+):
+    """runs projected gradient descent (BIM without random_start) on chunks of
+    images, samples stop once they are misclassified
+
+    Every step starts with the forward pass of the still active samples of the
+    chunk. Misclassified samples keep their current example and leave the working
+    batch, only the others get a gradient step, which is projected back into the
+    L-inf ball of radius epsilon around the clean image.
+
+    Args:
+        logits_model (Model): model which outputs the logits
+        X_true (np.ndarray): clean images
+        y_true (np.ndarray): one-hot labels or class indices
+        epsilon (float or np.ndarray): radius of the L-inf ball, or one radius per
+            image
+        n_steps (int, optional): most gradient steps per sample. Defaults to 10.
+        step_size (float, optional): size of a step. Defaults to
+            2.5 * epsilon / n_steps.
+        random_start (bool, optional): start at a uniform random point of the
+            ball, PGD, or at the clean image, BIM. Defaults to True.
+        batch_size (int, optional): images per chunk. Defaults to
+            ATTACK_BATCH_SIZE.
+        out (np.ndarray, optional): preallocated float32 output array. Defaults to
+            None.
+        seed (int, optional): seed of the random start. Defaults to None.
+
+    Returns:
+        out (np.ndarray): adversarial examples with the shape of X_true
+        steps (np.ndarray): gradient steps of every sample, 0 for samples which
+            were misclassified at the start
+    """
+    input_shape = tuple(logits_model.input_shape[1:])
+    labels = to_class_indices(y_true)
+    # per-image radii broadcast against the images
+    epsilon = np.asarray(epsilon, dtype="float32")
+    if epsilon.ndim:
+        epsilon = epsilon.reshape((-1,) + (1,) * len(input_shape))
+    step_size = 2.5 * epsilon / n_steps if step_size is None else step_size
+    step_size = np.asarray(step_size, dtype="float32")
+    rng = np.random.RandomState(seed)
+    if out is None:
+        out = np.empty((len(X_true),) + input_shape, dtype="float32")
+    steps = np.zeros(len(X_true), dtype="int32")
+
+    for start in range(0, len(X_true), batch_size):
+        end = min(start + batch_size, len(X_true))
+        x_clean = np.asarray(X_true[start:end], dtype="float32").reshape(
+            (end - start,) + input_shape
+        )
+        eps = epsilon[start:end] if epsilon.ndim else epsilon
+        step_eps = step_size[start:end] if step_size.ndim else step_size
+        x_adv = x_clean.copy()
+        if random_start:
+            x_adv += rng.uniform(-eps, eps, x_adv.shape).astype("float32")
+        active = np.arange(end - start)
+
+        for step in range(n_steps + 1):
+            x_batch = tf.convert_to_tensor(x_adv[active])
+            with tf.GradientTape() as tape:
+                tape.watch(x_batch)
+                logits = logits_model(x_batch)
+                loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
+                    labels=labels[start:end][active], logits=logits
+                )
+            # finished samples leave the working batch before the next step
+            correct = np.argmax(logits.numpy(), axis=-1) == labels[start:end][active]
+            if step == n_steps or not correct.any():
+                steps[start:end][active] = step
+                break
+            steps[start:end][active[~correct]] = step
 
-    X_adv = np.array(X_adv)
+            gradient = tape.gradient(loss, x_batch).numpy()[correct]
+            active = active[correct]
+            eps_active = eps[active] if eps.ndim else eps
+            step_active = step_eps[active] if step_eps.ndim else step_eps
+            x_step = x_adv[active] + step_active * np.sign(gradient)
+            x_adv[active] = np.clip(
+                x_step, x_clean[active] - eps_active, x_clean[active] + eps_active
+            )
 
+        out[start:end] = x_adv
+
+    return out, steps
+
+
+def get_pgd_examples(
+    pretrained_model,
+    X_true,
+    y_true,
+    epsilon,
+    n_steps=10,
+    step_size=None,
+    random_start=True,
+    batch_size=ATTACK_BATCH_SIZE,
+    out=None,
+    seed=None,
+    steps=None,
+):
+    """
+    returns the adversarial examples of projected gradient descent with early exit,
+    see projected_gradient_batches. The examples can be evaluated like the ones of
+    get_adversarial_examples. The gradient steps of every sample are written to
+    steps, an int32 array of len(X_true), if it is given.
+    """
+    logits_model = get_logits_model(pretrained_model)
+
+    X_adv, sample_steps = projected_gradient_batches(
+        logits_model,
+        X_true,
+        y_true,
+        epsilon,
+        n_steps=n_steps,
+        step_size=step_size,
+        random_start=random_start,
+        batch_size=batch_size,
+        out=out,
+        seed=seed,
+    )
+    if steps is not None:
+        steps[:] = sample_steps
     return X_adv
 
 
+def gradient_sign(logits_model, X_true, y_true, batch_size=ATTACK_BATCH_SIZE):
+    """sign of the loss gradient which fast gradient sign method scales by epsilon
+
+    Args:
+        logits_model (Model): model which outputs the logits
+        X_true (np.ndarray): clean images
+        y_true (np.ndarray): one-hot labels or class indices
+        batch_size (int, optional): images per gradient pass. Defaults to
+            ATTACK_BATCH_SIZE.
+
+    Returns:
+        sign (np.ndarray): int8 gradient sign with the shape of the model input
+    """
+    input_shape = tuple(logits_model.input_shape[1:])
+    labels = to_class_indices(y_true)
+    sign = np.empty((len(X_true),) + input_shape, dtype="int8")
+
+    for start in range(0, len(X_true), batch_size):
+        end = min(start + batch_size, len(X_true))
+        x_batch = tf.convert_to_tensor(
+            np.asarray(X_true[start:end], dtype="float32").reshape(
+                (end - start,) + input_shape
+            )
+        )
+        with tf.GradientTape() as tape:
+            tape.watch(x_batch)
+            # same loss as the cleverhans attack
+            loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
+                labels=labels[start:end], logits=logits_model(x_batch)
+            )
+        sign[start:end] = tf.sign(tape.gradient(loss, x_batch)).numpy()
+
+    return sign
+
+
+def weights_fingerprint(model):
+    """returns the sha256 of the current weights of a model
+
+    Models of model_factory are shared and get other weights loaded into them, so
+    results computed from a model are keyed by its weights and not by the object.
+    """
+    digest = hashlib.sha256()
+    for weights in model.get_weights():
+        digest.update(np.ascontiguousarray(weights).tobytes())
+    return digest.hexdigest()
+
+
+class FGSMSweep(object):
+    """
+    Fast gradient sign examples of one model and one input for any number of epsilons.
+    The perturbation is epsilon * sign(gradient) and the gradient does not depend on
+    epsilon, so the gradient sign is computed once and every epsilon only costs a
+    multiply-add over the input.
+    """
+
+    def __init__(self, pretrained_model, X_true, y_true, batch_size=ATTACK_BATCH_SIZE):
+        """[summary]
+
+        Args:
+            pretrained_model (Model): attacked model
+            X_true (np.ndarray): clean images
+            y_true (np.ndarray): one-hot labels or class indices
+            batch_size (int, optional): images per gradient pass. Defaults to
+                ATTACK_BATCH_SIZE.
+        """
+        logits_model = get_logits_model(pretrained_model)
+        self.X_true = X_true
+        self.weights = weights_fingerprint(pretrained_model)
+        self.sign = gradient_sign(logits_model, X_true, y_true, batch_size)
+
+    def examples(self, epsilon, stop=None, out=None):
+        """[summary]
+
+        Args:
+            epsilon (float): perturbation size
+            stop (int, optional): only the first stop examples. Defaults to None.
+            out (np.ndarray, optional): preallocated float32 output. Defaults to None.
+
+        Returns:
+            adversarial examples for epsilon, equal to get_adversarial_examples
+        """
+        sign = self.sign[:stop]
+        if out is None:
+            out = np.empty(sign.shape, dtype="float32")
+        np.multiply(sign, np.float32(epsilon), out=out, casting="unsafe")
+        out += np.asarray(self.X_true[: len(sign)], dtype="float32").reshape(sign.shape)
+        return out
+
+    def sweep(self, epsilons, stop=None):
+        """lazily yields (epsilon, adversarial examples) for every epsilon"""
+        for epsilon in epsilons:
+            yield epsilon, self.examples(epsilon, stop=stop)
+
+
+def get_fgsm_sweep(pretrained_model, X_true, y_true, batch_size=ATTACK_BATCH_SIZE):
+    """returns the FGSMSweep of a model and an input, computed once and cached
+
+    Args:
+        pretrained_model (Model): attacked model
+        X_true (np.ndarray): clean images, cached by the identity of the array
+        y_true (np.ndarray): one-hot labels or class indices
+        batch_size (int, optional): images per gradient pass. Defaults to
+            ATTACK_BATCH_SIZE.
+
+    Returns:
+        FGSMSweep: gradient sign of the current weights of the model on X_true
+    """
+    weights = weights_fingerprint(pretrained_model)
+    sweeps = _fgsm_sweeps.setdefault(pretrained_model, {})
+    sweep = sweeps.get((weights, id(X_true)))
+    if sweep is None or sweep.X_true is not X_true:
+        sweep = FGSMSweep(pretrained_model, X_true, y_true, batch_size)
+        sweeps[(weights, id(X_true))] = sweep
+    return sweep
+
+
+def clear_fgsm_sweeps(pretrained_model):
+    """drops the cached gradient signs of a model, e.g. before loading new weights"""
+    _fgsm_sweeps.pop(pretrained_model, None)
+
+
+def print_sweep(model, X_test, y_test, epsilons, weights_path=None, cache=None):
+    """
+    print_test for every epsilon, the attack is computed once for all of them
+    returns the list of (loss, acc), read from the cache with weights_path
+    """
+    sweep = get_fgsm_sweep(model, X_test, y_test)
+    return [
+        print_test(
+            model,
+            X_adv,
+            X_test,
+            y_test,
+            epsilon,
+            weights_path=weights_path,
+            cache=cache,
+        )
+        for epsilon, X_adv in sweep.sweep(epsilons)
+    ]
+
+
+def print_pgd(
+    model, X_test, y_test, epsilons, n_steps=10, weights_path=None, cache=None
+):
+    """
+    print_test for the projected gradient descent examples of every epsilon
+    together with the mean number of steps, returns the list of (loss, acc), read
+    from the cache with weights_path
+    """
+    results = []
+    for epsilon in epsilons:
+        steps = np.empty(len(X_test), dtype="int32")
+        X_adv = get_pgd_examples(
+            model, X_test, y_test, epsilon, n_steps=n_steps, steps=steps
+        )
+        print("epsilon: {} mean steps: {:.2f}".format(epsilon, np.mean(steps)))
+        results.append(
+            print_test(
+                model,
+                X_adv,
+                X_test,
+                y_test,
+                epsilon,
+                weights_path=weights_path,
+                cache=cache,
+                attack={"name": "pgd", "epsilon": epsilon, "n_steps": n_steps},
+            )
+        )
+    return results
+
+
 lrate_conv = LearningRateScheduler(step_decay_conv)
 lrate = LearningRateScheduler(step_decay)
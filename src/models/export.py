@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from _utility import get_fgsm_sweep, to_class_indices
+from person_store import open_store
+from model_factory import load_model
+
+EPSILONS = [0.001, 0.003, 0.005, 0.01, 0.03]
+# training images of the calibration of the int8 ranges
+CALIBRATION_SAMPLES = 500
+LATENCY_RUNS = 200
+
+
+def representative_dataset(X, n_samples=CALIBRATION_SAMPLES, seed=0):
+    """returns the calibration generator of the converter, single images of a fixed
+    random sample of X
+    """
+    rng = np.random.RandomState(seed)
+    index = np.sort(rng.choice(len(X), min(n_samples, len(X)), replace=False))
+
+    def generator():
+        for i in index:
+            yield [np.asarray(X[i : i + 1], dtype="float32")]
+
+    return generator
+
+
+def export_int8(model, X_calibration, path, n_samples=CALIBRATION_SAMPLES):
+    """[summary]
+
+    Args:
+        model (Model): trained keras model
+        X_calibration ([type]): training images of the calibration
+        path (str): written .tflite file
+        n_samples (int, optional): calibration images. Defaults to
+            CALIBRATION_SAMPLES.
+
+    Returns:
+        path of the int8 model. Weights and activations are int8, the input and the
+        output stay float32, so the model is a drop-in replacement of the float one.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset(
+        X_calibration, n_samples
+    )
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(path, "wb") as file_:
+        file_.write(converter.convert())
+    return path
+
+
+class TFLiteModel(object):
+    """
+    Batched predictions of a .tflite model with the interface of model.predict.
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.input_shape = tuple(self.interpreter.get_input_details()[0]["shape"][1:])
+        self.batch_size = None
+
+    def predict_on_batch(self, x):
+        if len(x) != self.batch_size:
+            self.interpreter.resize_tensor_input(
+                self.input_index, (len(x),) + self.input_shape
+            )
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(x)
+        x = np.asarray(x, dtype="float32").reshape((len(x),) + self.input_shape)
+        self.interpreter.set_tensor(self.input_index, x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+    def predict(self, X, batch_size=256):
+        return np.concatenate(
+            [
+                self.predict_on_batch(X[start : start + batch_size])
+                for start in range(0, len(X), batch_size)
+            ]
+        )
+
+
+def accuracy(y_pred, y_true):
+    return float(np.mean(np.argmax(y_pred, axis=-1) == to_class_indices(y_true)))
+
+
+def latency(predict_on_batch, x, runs=LATENCY_RUNS):
+    """returns the median and the p99 milliseconds of a single image prediction"""
+    predict_on_batch(x)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        predict_on_batch(x)
+        times.append(1000 * (time.perf_counter() - start))
+    return float(np.median(times)), float(np.percentile(times, 99))
+
+
+def compare(model, weights_path, tflite_path, X_test, y_test, epsilons=EPSILONS):
+    """[summary]
+
+    Args:
+        model (Model): float model holding the weights of weights_path
+        weights_path (str): .h5 file of the float model
+        tflite_path (str): int8 model exported from it
+        X_test ([type]): clean test images
+        y_test ([type]): one-hot labels
+        epsilons (list, optional): FGSM epsilons. Defaults to EPSILONS.
+
+    Returns:
+        report (dict): clean and FGSM accuracy, size and latency of both models.
+        The int8 model has no gradients, the FGSM examples are computed on the float
+        model and evaluated on both, i.e. a white-box attack on the float weights.
+    """
+    quantized = TFLiteModel(tflite_path)
+    sweep = get_fgsm_sweep(model, X_test, y_test)
+    X_clean = np.asarray(X_test, dtype="float32").reshape(
+        (len(X_test),) + quantized.input_shape
+    )
+
+    report = {}
+    for name, predictor, path in (
+        ("float", model, weights_path),
+        ("int8", quantized, tflite_path),
+    ):
+        result = {
+            "size_bytes": os.path.getsize(path),
+            "acc_clean": accuracy(predictor.predict(X_clean), y_test),
+        }
+        for epsilon, X_adv in sweep.sweep(epsilons):
+            result[str(epsilon) + "_acc"] = accuracy(predictor.predict(X_adv), y_test)
+        result["latency_ms_p50"], result["latency_ms_p99"] = latency(
+            predictor.predict_on_batch, X_clean[:1]
+        )
+        report[name] = result
+    return report
+
+
+def print_report(report):
+    keys = list(report["float"])
+    print("{:>16} {:>14} {:>14}".format("", "float", "int8"))
+    for key in keys:
+        print(
+            "{:>16} {:>14.4f} {:>14.4f}".format(
+                key, report["float"][key], report["int8"][key]
+            )
+        )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="int8 TFLite export of a trained model with a robustness report"
+    )
+    parser.add_argument("weights", help="e.g. ResNet/ResNet_0.h5")
+    parser.add_argument(
+        "--architecture", default="ResNet", help="key of model_factory.ARCHITECTURES"
+    )
+    parser.add_argument("--data", default="data.pz")
+    parser.add_argument("--k", type=int, default=1, help="width of the networks")
+    parser.add_argument("--calibration-samples", type=int, default=CALIBRATION_SAMPLES)
+    arguments = parser.parse_args()
+
+    if arguments.architecture in ("ResNet", "Parseval"):
+        args = ((32, 32, 1), 0.0001, 0.9)
+        kwargs = dict(nb_classes=4, N=2, k=arguments.k, dropout=0.0)
+    else:
+        args, kwargs = (0.0001,), {}
+
+    # calibration on training persons, report on the stored test persons
+    data = open_store(arguments.data).load_split(("train", "test"))
+    model = load_model(arguments.weights, arguments.architecture, *args, **kwargs)
+    tflite_path = os.path.splitext(arguments.weights)[0] + "_int8.tflite"
+    export_int8(model, data["xtrain"], tflite_path, arguments.calibration_samples)
+
+    report = compare(
+        model, arguments.weights, tflite_path, data["xtest"], data["ytest"]
+    )
+    with open(os.path.splitext(tflite_path)[0] + "_report.json", "w") as file_:
+        json.dump(report, file_, indent=4)
+    print_report(report)
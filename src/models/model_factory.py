@@ -0,0 +1,74 @@
+from tensorflow.keras.optimizers import SGD
+
+from _utility import clear_fgsm_sweeps
+
+from wresnet import WideResidualNetwork
+from parsevalnet import ParsevalNetwork
+from model import basemodel, model_2, model_3
+from parseval import model_parseval
+
+
+def _wide_residual_network(*args, **kwargs):
+    return WideResidualNetwork(*args, **kwargs).create_wide_residual_network()
+
+
+def _parseval_network(*args, **kwargs):
+    return ParsevalNetwork(*args, **kwargs).create_wide_residual_network()
+
+
+ARCHITECTURES = {
+    "ResNet": _wide_residual_network,
+    "Parseval": _parseval_network,
+    "CNN": basemodel,
+    "CNN_2": model_2,
+    "CNN_3": model_3,
+    "CNN_Parseval": model_parseval,
+}
+
+# compiled models of this process, by architecture and constructor arguments
+_models = {}
+
+
+def get_model(architecture, *args, **kwargs):
+    """returns the compiled model of an architecture, built once per process
+
+    Models are cached by the architecture and the constructor arguments. Loading
+    other weights into the returned model reuses its graph and its traced
+    predict and evaluate functions.
+
+    Args:
+        architecture (str): key of ARCHITECTURES
+        *args, **kwargs: constructor arguments of the architecture
+
+    Returns:
+        Model: compiled model, shared by every caller with the same arguments
+    """
+    key = repr((architecture, args, sorted(kwargs.items())))
+    model = _models.get(key)
+    if model is None:
+        model = ARCHITECTURES[architecture](*args, **kwargs)
+        model.compile(
+            loss="categorical_crossentropy",
+            optimizer=SGD(lr=0.1, momentum=0.9),
+            metrics=["acc"],
+        )
+        _models[key] = model
+    return model
+
+
+def load_model(weights_path, architecture, *args, **kwargs):
+    """swaps the weights of a .h5 file into the cached model of the architecture
+
+    Args:
+        weights_path (str): weights saved by model.save_weights or model.save
+        architecture (str): key of ARCHITECTURES
+        *args, **kwargs: constructor arguments of the architecture
+
+    Returns:
+        Model: the cached model holding the loaded weights
+    """
+    model = get_model(architecture, *args, **kwargs)
+    model.load_weights(weights_path)
+    # the gradient signs of the previous weights are not used again
+    clear_fgsm_sweeps(model)
+    return model
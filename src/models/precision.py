@@ -0,0 +1,43 @@
+import contextlib
+import functools
+
+import tensorflow as tf
+
+# bfloat16 computations with float32 variables, needs no loss scaling
+MIXED_POLICY = "mixed_bfloat16"
+
+
+@contextlib.contextmanager
+def precision_policy(mixed_precision=False):
+    """builds the layers created inside the block with the bfloat16 policy
+
+    Layers take the global policy when they are created, so the policy is set for
+    the block only and the previous one is restored afterwards. The variables, and
+    with them the kernel constraints, stay float32. Layers which must compute in
+    float32, as the softmax output, are created with dtype="float32".
+
+    Args:
+        mixed_precision (bool, optional): use MIXED_POLICY. Defaults to False, the
+            block is built with the current policy.
+    """
+    if not mixed_precision:
+        yield
+        return
+
+    previous = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy(MIXED_POLICY)
+    try:
+        yield
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous)
+
+
+def with_precision_policy(build):
+    """adds a mixed_precision keyword argument to a model builder function"""
+
+    @functools.wraps(build)
+    def build_with_policy(*args, mixed_precision=False, **kwargs):
+        with precision_policy(mixed_precision):
+            return build(*args, **kwargs)
+
+    return build_with_policy
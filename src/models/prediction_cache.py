@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import weakref
+
+import numpy as np
+
+CACHE_DIR = ".prediction_cache"
+
+# file hashes of this process, by path, size and modification time
+_file_hashes = {}
+
+
+def weights_hash(path):
+    """returns the sha256 of a weights file, hashed once per file version"""
+    stat = os.stat(path)
+    stamp = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if stamp not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file_:
+            for chunk in iter(lambda: file_.read(1 << 20), b""):
+                digest.update(chunk)
+        _file_hashes[stamp] = digest.hexdigest()
+    return _file_hashes[stamp]
+
+
+def array_hash(X):
+    """returns the sha256 of the shape, dtype and content of an input array
+
+    The array is hashed in the canonical shape (samples, features), so that e.g.
+    (n, 32, 32) and (n, 32, 32, 1) images have the same key.
+    """
+    X = np.ascontiguousarray(X).reshape(len(X), -1)
+    digest = hashlib.sha256()
+    digest.update("{}{}".format(X.shape, X.dtype).encode())
+    digest.update(memoryview(X).cast("B"))
+    return digest.hexdigest()
+
+
+class PredictionCache(object):
+    """
+    Persistent cache of model outputs, keyed by the weights file, the input and the
+    attack which perturbed it. Outputs are stored as float32 .npy files
+    together with the regularization loss of the weights, so that loss and
+    accuracy can be computed again without loading or running the model.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._input_hashes = {}
+
+    def key(self, weights_path, X, attack=None):
+        """[summary]
+
+        Args:
+            weights_path (str): weights file of the model
+            X ([type]): inputs, the clean ones when the attack is run by make_input
+                of predict, else the attacked ones
+            attack (dict, optional): json serializable attack spec, e.g.
+                {"name": "fgsm", "epsilon": 0.01}. Defaults to None, clean inputs.
+
+        Returns:
+            key (str): file name of the cache entry
+        """
+        spec = json.dumps(attack, sort_keys=True)
+        digest = hashlib.sha256(
+            "{}:{}:{}".format(
+                weights_hash(weights_path), self.input_hash(X), spec
+            ).encode()
+        )
+        return digest.hexdigest()[:32]
+
+    def input_hash(self, X):
+        """array_hash of X, computed once per array object while it is alive, the
+        inputs are reused for every model"""
+        entry = self._input_hashes.get(id(X))
+        if entry is None or entry[0]() is not X:
+            key = id(X)
+            entry = (
+                weakref.ref(X, lambda _: self._input_hashes.pop(key, None)),
+                array_hash(X),
+            )
+            self._input_hashes[key] = entry
+        return entry[1]
+
+    def predict(self, get_model, weights_path, X, attack=None, make_input=None):
+        """[summary]
+
+        Args:
+            get_model (callable): returns the compiled model holding the weights of
+                weights_path, only called on a cache miss
+            weights_path (str): weights file of the model
+            X ([type]): clean inputs
+            attack (dict, optional): attack spec, see key. Defaults to None.
+            make_input (callable, optional): make_input(model, X) returns the
+                attacked inputs, only called on a cache miss. Defaults to None.
+
+        Returns:
+            predictions of the model for the (attacked) inputs
+        """
+        return self._entry(get_model, weights_path, X, attack, make_input)[0]
+
+    def evaluate(self, get_model, weights_path, X, y, attack=None, make_input=None):
+        """[summary]
+
+        Args:
+            y ([type]): one-hot labels or class indices
+            other arguments: see predict
+
+        Returns:
+            loss, acc: as returned by model.evaluate with the (sparse) categorical
+                cross-entropy
+        """
+        y_pred, reg_loss = self._entry(get_model, weights_path, X, attack, make_input)
+        y_pred = np.clip(y_pred, 1e-7, 1 - 1e-7)
+        labels = np.asarray(y)
+        if labels.ndim > 1:
+            labels = np.argmax(labels, axis=-1)
+        loss = -np.mean(np.log(y_pred[np.arange(len(labels)), labels])) + reg_loss
+        acc = np.mean(np.argmax(y_pred, axis=-1) == labels)
+        return float(loss), float(acc)
+
+    def _entry(self, get_model, weights_path, X, attack, make_input):
+        path = os.path.join(self.cache_dir, self.key(weights_path, X, attack))
+        if os.path.exists(path + ".npy") and os.path.exists(path + ".json"):
+            with open(path + ".json") as file_:
+                meta = json.load(file_)
+            return np.load(path + ".npy"), meta["reg_loss"]
+
+        model = get_model()
+        X_input = X if make_input is None else make_input(model, X)
+        y_pred = model.predict(X_input).astype("float32")
+        reg_loss = float(sum(float(loss) for loss in model.losses))
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.save(path + ".tmp.npy", y_pred)
+        os.replace(path + ".tmp.npy", path + ".npy")
+        with open(path + ".json.tmp", "w") as file_:
+            json.dump(
+                {"weights": weights_path, "attack": attack, "reg_loss": reg_loss},
+                file_,
+            )
+        os.replace(path + ".json.tmp", path + ".json")
+
+        return y_pred, reg_loss
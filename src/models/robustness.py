@@ -0,0 +1,339 @@
+import argparse
+import glob
+import gzip
+import json
+
+import numpy as np
+
+from _utility import (
+    get_logits_model,
+    gradient_sign,
+    projected_gradient_batches,
+    to_class_indices,
+)
+from person_store import open_store
+from model_factory import load_model
+from prediction_cache import PredictionCache
+
+CHUNK_SIZE = 512
+# width of the per-sample SNR buckets in dB
+BUCKET_WIDTH = 5.0
+# iterative attacks and their random start, see projected_gradient_batches
+ITERATIVE_ATTACKS = {"pgd": True, "bim": False}
+ATTACKS = ("fgsm",) + tuple(ITERATIVE_ATTACKS)
+
+
+def attack_levels(epsilons=(), snrs=()):
+    """[summary]
+
+    Args:
+        epsilons (list, optional): fixed FGSM epsilons. Defaults to ().
+        snrs (list, optional): target SNRs in dB, every sample gets the epsilon which
+            gives it this SNR. Defaults to ().
+
+    Returns:
+        list of (name, kind, value), the clean level first
+    """
+    levels = [("clean", "clean", None)]
+    levels += [(str(epsilon), "epsilon", float(epsilon)) for epsilon in epsilons]
+    levels += [("snr_" + str(snr), "snr", float(snr)) for snr in snrs]
+    return levels
+
+
+def evaluate_model(
+    model,
+    X_test,
+    y_test,
+    levels,
+    chunk_size=CHUNK_SIZE,
+    weights_path=None,
+    cache=None,
+    attack="fgsm",
+    n_steps=10,
+    seed=0,
+):
+    """evaluates one model on every attack level in one streaming pass over X_test
+
+    For FGSM the gradient sign of every chunk is computed once and reused by all
+    levels. PGD and BIM run projected_gradient_batches on every chunk and level;
+    the epsilon of a target SNR is the one whose L-inf ball corner has this SNR.
+
+    Args:
+        model (Model): compiled model
+        X_test ([type]): clean inputs
+        y_test ([type]): one-hot labels
+        levels (list): see attack_levels
+        chunk_size (int, optional): examples per chunk. Defaults to CHUNK_SIZE.
+        weights_path (str, optional): weights file of the model, the clean
+            predictions are read from the cache with it. Defaults to None.
+        cache (PredictionCache, optional): Defaults to a PredictionCache.
+        attack (str, optional): one of ATTACKS. Defaults to "fgsm".
+        n_steps (int, optional): most steps of PGD and BIM. Defaults to 10.
+        seed (int, optional): seed of the PGD random start. Defaults to 0.
+
+    Raises:
+        ValueError: unknown attack
+
+    Returns:
+        dict of level name to loss, acc, global SNR like print_test and the per-sample
+        SNR buckets with their loss and accuracy, for PGD and BIM also the mean
+        gradient steps
+    """
+    if attack not in ATTACKS:
+        raise ValueError(
+            "Unknown attack {}, expected one of {}".format(attack, ATTACKS)
+        )
+    iterative = attack in ITERATIVE_ATTACKS
+    logits_model = get_logits_model(model)
+    input_shape = tuple(logits_model.input_shape[1:])
+    reg_loss = float(sum(float(loss) for loss in model.losses))
+    labels = to_class_indices(y_test)
+    totals = {
+        name: {"loss": 0.0, "correct": 0, "noise": 0.0, "steps": 0, "buckets": {}}
+        for name, _, _ in levels
+    }
+    signal = 0.0
+    clean_pred = None
+    if weights_path is not None:
+        cache = cache or PredictionCache()
+        clean_pred = cache.predict(lambda: model, weights_path, X_test)
+
+    for start in range(0, len(X_test), chunk_size):
+        end = min(start + chunk_size, len(X_test))
+        x = np.asarray(X_test[start:end], dtype="float32").reshape(
+            (end - start,) + input_shape
+        )
+        y = labels[start:end]
+        axes = tuple(range(1, x.ndim))
+        if iterative:
+            # noise norm of a unit L-inf perturbation in every pixel
+            sign_norm = np.full(len(x), np.sqrt(np.prod(input_shape)), "float32")
+        else:
+            sign = gradient_sign(logits_model, x, y, batch_size=chunk_size)
+            sign = sign.astype("float32")
+            sign_norm = np.sqrt(np.sum(np.square(sign), axis=axes))
+
+        x_norm = np.sqrt(np.sum(np.square(x), axis=axes))
+        signal += float(np.sum(np.square(x_norm)))
+
+        for name, kind, value in levels:
+            if kind == "clean":
+                epsilon = np.zeros(len(x), dtype="float32")
+            elif kind == "epsilon":
+                epsilon = np.full(len(x), value, dtype="float32")
+            else:
+                epsilon = x_norm / (10 ** (value / 20) * np.maximum(sign_norm, 1e-12))
+            epsilon = epsilon.astype("float32")
+
+            noise_norm = epsilon * sign_norm
+            if kind == "clean" and clean_pred is not None:
+                y_pred = clean_pred[start:end]
+            elif kind == "clean":
+                y_pred = model.predict_on_batch(x)
+            elif iterative:
+                x_adv, steps = projected_gradient_batches(
+                    logits_model,
+                    x,
+                    y,
+                    epsilon,
+                    n_steps=n_steps,
+                    random_start=ITERATIVE_ATTACKS[attack],
+                    batch_size=chunk_size,
+                    seed=seed + start,
+                )
+                totals[name]["steps"] += int(np.sum(steps))
+                noise_norm = np.sqrt(np.sum(np.square(x_adv - x), axis=axes))
+                y_pred = model.predict_on_batch(x_adv)
+            else:
+                x_adv = x + epsilon.reshape((-1,) + (1,) * len(input_shape)) * sign
+                y_pred = model.predict_on_batch(x_adv)
+            y_pred = np.clip(np.asarray(y_pred, dtype="float64"), 1e-7, 1 - 1e-7)
+            loss = -np.log(y_pred[np.arange(len(y)), y])
+            correct = np.argmax(y_pred, axis=-1) == y
+
+            with np.errstate(divide="ignore"):
+                snr = 20 * np.log10(x_norm / noise_norm)
+
+            total = totals[name]
+            total["loss"] += float(np.sum(loss))
+            total["correct"] += int(np.sum(correct))
+            total["noise"] += float(np.sum(np.square(noise_norm)))
+            update_buckets(total["buckets"], snr, loss, correct)
+
+    results = {}
+    for name, _, _ in levels:
+        total = totals[name]
+        if total["noise"] > 0:
+            snr = 10 * np.log10(signal / total["noise"])
+        else:
+            snr = float("inf")
+        results[name] = {
+            "loss": total["loss"] / len(X_test) + reg_loss,
+            "acc": total["correct"] / len(X_test),
+            "SNR": float(snr),
+            "buckets": summarize_buckets(total["buckets"], reg_loss),
+        }
+        if iterative:
+            results[name]["steps"] = total["steps"] / len(X_test)
+    return results
+
+
+def update_buckets(buckets, snr, loss, correct):
+    """adds the per-sample results to their BUCKET_WIDTH dB wide SNR buckets"""
+    finite = np.isfinite(snr)
+    keys = np.where(finite, np.floor(snr / BUCKET_WIDTH) * BUCKET_WIDTH, np.inf)
+    for key in np.unique(keys):
+        mask = keys == key
+        bucket = buckets.setdefault(float(key), [0, 0.0, 0])
+        bucket[0] += int(np.sum(mask))
+        bucket[1] += float(np.sum(loss[mask]))
+        bucket[2] += int(np.sum(correct[mask]))
+
+
+def summarize_buckets(buckets, reg_loss):
+    return [
+        {
+            "SNR": key,
+            "count": count,
+            "loss": loss_sum / count + reg_loss,
+            "acc": correct / count,
+        }
+        for key, (count, loss_sum, correct) in sorted(buckets.items())
+    ]
+
+
+def evaluate(
+    models,
+    X_test,
+    y_test,
+    levels,
+    output_prefix,
+    chunk_size=CHUNK_SIZE,
+    cache=None,
+    attack="fgsm",
+    n_steps=10,
+):
+    """[summary]
+
+    Args:
+        models (dict): name to (architecture, weights files of the folds, args, kwargs)
+        X_test ([type]): clean inputs
+        y_test ([type]): one-hot labels
+        levels (list): see attack_levels
+        output_prefix (str): prefix of the written files
+        chunk_size (int, optional): examples per chunk. Defaults to CHUNK_SIZE.
+        cache (PredictionCache, optional): cache of the clean predictions.
+            Defaults to a PredictionCache.
+        attack (str, optional): see evaluate_model. Defaults to "fgsm".
+        n_steps (int, optional): see evaluate_model. Defaults to 10.
+
+    Writes:
+        <prefix>_<model>.json.gz: one line per fold with loss_clean, acc_clean,
+            <level>_loss, <level>_acc and the fold means <level>_mean
+        <prefix>.json: one object per level with the SNR and mean_<model>, as
+            result_ResNet.json
+        <prefix>_buckets.json: per model, level and SNR bucket the loss and accuracy
+    """
+    cache = cache or PredictionCache()
+    fold_results = {}
+    for name, (architecture, weights_files, args, kwargs) in models.items():
+        fold_results[name] = []
+        for weights_path in weights_files:
+            print(weights_path)
+            model = load_model(weights_path, architecture, *args, **kwargs)
+            fold_results[name].append(
+                evaluate_model(
+                    model,
+                    X_test,
+                    y_test,
+                    levels,
+                    chunk_size,
+                    weights_path=weights_path,
+                    cache=cache,
+                    attack=attack,
+                    n_steps=n_steps,
+                )
+            )
+
+    buckets = {}
+    for name, folds in fold_results.items():
+        means = {
+            level: float(np.mean([fold[level]["acc"] for fold in folds]))
+            for level, _, _ in levels
+        }
+        with gzip.open(output_prefix + "_" + name + ".json.gz", "wt") as file_:
+            for fold in folds:
+                row = {}
+                for level, _, _ in levels:
+                    row[level + "_loss"] = fold[level]["loss"]
+                    row[level + "_acc"] = fold[level]["acc"]
+                    if "steps" in fold[level]:
+                        row[level + "_steps"] = fold[level]["steps"]
+                row["loss_clean"] = row.pop("clean_loss")
+                row["acc_clean"] = row.pop("clean_acc")
+                for level, mean in means.items():
+                    row[level + "_mean"] = mean
+                file_.write(json.dumps(row) + "\n")
+        buckets[name] = {
+            level: [fold[level]["buckets"] for fold in folds] for level, _, _ in levels
+        }
+
+    with open(output_prefix + ".json", "w") as file_:
+        for level, _, _ in levels:
+            # the SNR of a level is the mean over every model and fold
+            snrs = [
+                fold[level]["SNR"] for folds in fold_results.values() for fold in folds
+            ]
+            snr = np.mean(snrs)
+            row = {"SNR": float(snr)}
+            for name, folds in fold_results.items():
+                row["mean_" + name] = float(
+                    np.mean([fold[level]["acc"] for fold in folds])
+                )
+            json.dump(row, file_, indent=4)
+
+    with open(output_prefix + "_buckets.json", "w") as file_:
+        json.dump(buckets, file_)
+
+    return fold_results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="FGSM robustness of saved models in one pass per model"
+    )
+    parser.add_argument(
+        "--model",
+        nargs=3,
+        action="append",
+        metavar=("NAME", "ARCHITECTURE", "GLOB"),
+        required=True,
+        help="e.g. ResNet ResNet 'ResNet/ResNet_*.h5'",
+    )
+    parser.add_argument("--epsilons", nargs="*", type=float, default=[])
+    parser.add_argument("--snrs", nargs="*", type=float, default=[])
+    parser.add_argument("--attack", choices=ATTACKS, default="fgsm")
+    parser.add_argument("--n-steps", type=int, default=10, help="steps of pgd/bim")
+    parser.add_argument("--data", default="data.pz")
+    parser.add_argument("--k", type=int, default=1, help="width of the networks")
+    parser.add_argument("--output", default="result")
+    arguments = parser.parse_args()
+
+    # test persons of the stored person-grouped split
+    data = open_store(arguments.data).load_split(("test",))
+    wrn_args = ((32, 32, 1), 0.0001, 0.9)
+    wrn_kwargs = dict(nb_classes=4, N=2, k=arguments.k, dropout=0.0)
+    models = {
+        name: (architecture, sorted(glob.glob(pattern)), wrn_args, wrn_kwargs)
+        for name, architecture, pattern in arguments.model
+    }
+    evaluate(
+        models,
+        data["xtest"],
+        data["ytest"],
+        attack_levels(arguments.epsilons, arguments.snrs),
+        arguments.output,
+        attack=arguments.attack,
+        n_steps=arguments.n_steps,
+    )
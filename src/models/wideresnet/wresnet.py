@@ -7,6 +7,8 @@ from tensorflow.keras import backend as K
 from tensorflow.keras.optimizers import SGD
 import warnings
 
+from precision import precision_policy
+
 warnings.filterwarnings("ignore")
 
 
@@ -21,6 +23,7 @@ class WideResidualNetwork(object):
         k=1,
         dropout=0.0,
         verbose=1,
+        mixed_precision=False,
     ):
         """[Assign the initial parameters of the wide residual network]
 
@@ -32,6 +35,8 @@ class WideResidualNetwork(object):
             k (int, optional): [network width]. Defaults to 1.
             dropout (float, optional): [dropout value to prevent overfitting]. Defaults to 0.0.
             verbose (int, optional): [description]. Defaults to 1.
+            mixed_precision (bool, optional): run the convolutions in bfloat16, the
+                softmax stays float32. Defaults to False.
 
         Returns:
             [Model]: [wideresnet]
@@ -43,6 +48,7 @@ class WideResidualNetwork(object):
         self.k = k
         self.dropout = dropout
         self.verbose = verbose
+        self.mixed_precision = mixed_precision
 
     def initial_conv(self, input):
         """[summary]
@@ -270,6 +276,10 @@ class WideResidualNetwork(object):
         Returns:
             [Model]: [wide residual network]
         """
+        with precision_policy(self.mixed_precision):
+            return self.build_wide_residual_network()
+
+    def build_wide_residual_network(self):
         channel_axis = 1 if K.image_data_format() == "channels_first" else -1
 
         ip = Input(shape=self.input_dim)
@@ -320,6 +330,7 @@ class WideResidualNetwork(object):
             self.nb_classes,
             kernel_regularizer=l2(self.weight_decay),
             activation="softmax",
+            dtype="float32",
         )(x)
 
         model = Model(ip, x)
@@ -0,0 +1,56 @@
+import gzip
+import os
+import pickle
+import time
+
+import cv2
+import numpy as np
+
+from resize import resize_crops
+
+SCALES = (1, 10, 100)
+SIZE = (32, 32)
+
+
+def load_crops(source="data.pz"):
+    """returns the crops of data.pz, or random crops of eye-crop sizes without it"""
+    if os.path.exists(source):
+        with open(source, "rb") as file_:
+            with gzip.GzipFile(fileobj=file_) as gzf:
+                data = pickle.load(gzf, encoding="latin1", fix_imports=True)
+        return [row["crop"] for row in data]
+
+    rng = np.random.RandomState(0)
+    shapes = [(h, w) for h in range(20, 40, 2) for w in range(30, 60, 3)]
+    return [
+        rng.randint(0, 256, size=shapes[rng.randint(len(shapes))], dtype="uint8")
+        for _ in range(6800)
+    ]
+
+
+def loop_resize(crops, size=SIZE):
+    """the per-record loop of preprocessing_data"""
+    return np.array([cv2.resize(crop, size) for crop in crops]).astype("float32")
+
+
+def benchmark(resize, crops):
+    start = time.perf_counter()
+    resize(crops)
+    return len(crops) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+
+    crops = load_crops()
+    print("{} crops, {} shapes".format(len(crops), len({c.shape for c in crops})))
+    for scale in SCALES:
+        # the same crop objects repeated, only the output grows
+        scaled = crops * scale
+        loop = benchmark(loop_resize, scaled)
+        bucketed = benchmark(resize_crops, scaled)
+        print(
+            "{:>4}x ({:>8} crops): loop {:10.1f} crops/sec, bucketed {:10.1f} "
+            "crops/sec ({:.1f}x)".format(
+                scale, len(scaled), loop, bucketed, bucketed / loop
+            )
+        )
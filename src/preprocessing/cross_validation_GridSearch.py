@@ -1,16 +1,28 @@
 from sklearn.model_selection import KFold
-from sklearn.model_selection import train_test_split
 from tensorflow.keras.callbacks import EarlyStopping
 
 from itertools import product
+import json
+import os
 import pickle
 import pandas as pd
 import sys
+import time
 
 sys.path.insert(1, "/home/sefika/AE_Parseval_Network/src")
+# flat imports of the model modules, e.g. precision and _utility
+sys.path.insert(1, "/home/sefika/AE_Parseval_Network/src/models")
 from models.wideresnet.wresnet import WideResidualNetwork
-from data.preprocessing import preprocessing
+from models._utility import loss_for
+from preprocessing.person_store import load_folds
+from train.augmentation import image_data_generator, training_flow
 import tensorflow
+from tensorflow.keras.optimizers import SGD
+
+# folds of every combination
+N_SPLITS = 3
+# shuffle of the persons of the stored split
+SPLIT_SEED = 42
 
 
 class ModelSelection(object):
@@ -25,11 +37,25 @@ class ModelSelection(object):
         pass
 
     def KFold_GridSearchCV(
-        self, input_dim, X, Y, X_test, y_test, combinations, filename="log.csv"
+        self,
+        input_dim,
+        X,
+        Y,
+        X_test,
+        y_test,
+        combinations,
+        filename="log.csv",
+        pipeline="generator",
+        folds=None,
+        seed=None,
     ):
-        # create containers for resulting data
         """[summary]
 
+        Every finished (combination, fold) is appended to the journal next to
+        filename, keyed by the fold definition as well. A restarted search skips the
+        journaled work of the same folds, and the summary csv is rebuilt from the
+        journal.
+
         Args:
             input_dim ([type]): [description]
             X ([type]): [description]
@@ -38,75 +64,329 @@ class ModelSelection(object):
             y_test ([type]): [description]
             combinations ([type]): [description]
             filename (str, optional): [description]. Defaults to "log.csv".
+            pipeline (str, optional): augmentation pipeline, "generator" or "tf.data".
+                Defaults to "generator".
+            folds (list, optional): (train, val) indices of X, e.g. the
+                person-grouped folds of load_folds. Defaults to N_SPLITS KFold folds.
+            seed (int, optional): seed of the person split of folds, None for
+                folds without a shuffle. Defaults to None.
         """
-        wresnet_ins = WideResidualNetwork()
-        res_df = pd.DataFrame(
-            columns=[
-                "momentum",
-                "learning rate",
-                "batch size",
-                "loss1",
-                "acc1",
-                "loss2",
-                "acc2",
-                "loss3",
-                "acc3",
-            ]
-        )
-        generator = tensorflow.keras.preprocessing.image.ImageDataGenerator(
-            rotation_range=10,
-            width_shift_range=5.0 / 32,
-            height_shift_range=5.0 / 32,
-        )
-        hist_dict_global = {}
+        if folds is None:
+            folds = list(KFold(n_splits=N_SPLITS, shuffle=False).split(X))
+        definition = fold_definition(folds, seed)
+        journal = journal_path(filename)
+        entries = read_journal(journal, definition)
+        done = {(tuple(entry["combination"]), entry["fold"]) for entry in entries}
+        generator = image_data_generator()
+
         for i, combination in enumerate(combinations):
-            kf = KFold(n_splits=3, random_state=42, shuffle=False)
-            metrics_dict = {}
+            for j, (train_index, test_index) in enumerate(folds):
+                if (tuple(combination), j + 1) in done:
+                    continue
 
-            for j, (train_index, test_index) in enumerate(kf.split(X)):
                 X_train, X_val = X[train_index], X[test_index]
                 y_train, y_val = Y[train_index], Y[test_index]
-                model = wresnet_ins.create_wide_residual_network(
-                    combination[2],
-                    combination[0],
-                    input_dim,
-                    combination[4],
-                    nb_classes=4,
-                    N=2,
-                    k=2,
-                    dropout=0.0,
-                )
-                model.fit_generator(
-                    generator.flow(X_train, y_train, batch_size=combination[1]),
+                model = self.build_model(input_dim, combination, loss_for(Y))
+                model.fit(
+                    training_flow(
+                        X_train, y_train, combination[1], pipeline, generator
+                    ),
                     steps_per_epoch=len(X_train) // combination[1],
                     epochs=combination[3],
                     validation_data=(X_val, y_val),
                     validation_steps=len(X_val) // combination[1],
                 )
                 loss, acc = model.evaluate(X_test, y_test)
-                metrics_dict[j + 1] = {
-                    "loss": loss,
-                    "acc": acc,
-                    "epoch_stopped": combination[3],
-                }
-            row = {
-                "momentum": combination[4],
-                "learning rate": combination[0],
-                "batch size": combination[1],
-                "reg_penalty": combination[2],
-                "epoch_stopped1": metrics_dict[1]["epoch_stopped"],
-                "loss1": metrics_dict[1]["loss"],
-                "acc1": metrics_dict[1]["acc"],
-                "acc1": metrics_dict[1]["acc"],
-                "epoch_stopped2": metrics_dict[2]["epoch_stopped"],
-                "loss2": metrics_dict[2]["loss"],
-                "acc2": metrics_dict[2]["acc"],
-                "epoch_stopped3": metrics_dict[3]["epoch_stopped"],
-                "loss3": metrics_dict[3]["loss"],
-                "acc3": metrics_dict[3]["acc"],
-            }
-            res_df = res_df.append(row, ignore_index=True)
-            res_df.to_csv(filename, sep=";")
+                append_journal(
+                    journal,
+                    {
+                        "combination": list(combination),
+                        "fold": j + 1,
+                        "loss": loss,
+                        "acc": acc,
+                        "epoch_stopped": combination[3],
+                        **definition,
+                    },
+                )
+
+        summary = summarize_journal(read_journal(journal, definition), len(folds))
+        summary.to_csv(filename, sep=";")
+        return summary
+
+    def KFold_SuccessiveHalving(
+        self,
+        input_dim,
+        X,
+        Y,
+        X_test,
+        y_test,
+        combinations,
+        filename="log.csv",
+        eta=3,
+        pipeline="generator",
+        folds=None,
+        seed=None,
+    ):
+        """[summary]
+
+        Successive halving over the grid: the epochs values of the grid are the
+        budgets of the rounds, all the other parameters form the candidates. Every
+        candidate is trained up to the smallest epochs value on each fold, only the
+        best 1/eta of them by mean validation accuracy are kept, and the survivors
+        continue training up to the next epochs value until one candidate is left
+        or the largest epochs value is reached.
+
+        Every finished (candidate, round, fold) is appended to the journal next to
+        filename as in KFold_GridSearchCV, and the weights of the survivors are
+        written to a folder next to it, so a restarted search continues after the
+        journaled rounds.
+
+        Args:
+            input_dim ([type]): [description]
+            X ([type]): [description]
+            Y ([type]): [description]
+            X_test ([type]): [description]
+            y_test ([type]): [description]
+            combinations ([type]): [description]
+            filename (str, optional): [description]. Defaults to "log.csv".
+            eta (int, optional): reduction factor of every round. Defaults to 3.
+            pipeline (str, optional): augmentation pipeline, "generator" or "tf.data".
+                Defaults to "generator".
+            folds (list, optional): (train, val) indices of X, e.g. the
+                person-grouped folds of load_folds. Defaults to N_SPLITS KFold folds.
+            seed (int, optional): seed of the person split of folds, None for
+                folds without a shuffle. Defaults to None.
+
+        Returns:
+            DataFrame: one row per (candidate, budget) in the schema of the grid
+            search, the combinations and epoch_stopped are those of the grid
+        """
+        start = time.time()
+        if folds is None:
+            folds = list(KFold(n_splits=N_SPLITS, shuffle=False).split(X))
+        definition = fold_definition(folds, seed)
+        journal = journal_path(filename)
+        done = {
+            (tuple(entry["combination"]), entry["fold"]): entry
+            for entry in read_journal(journal, definition)
+        }
+        folder = weights_folder(filename, definition)
+        os.makedirs(folder, exist_ok=True)
+        budgets = sorted({combination[3] for combination in combinations})
+        candidates = sorted({(c[0], c[1], c[2], c[4]) for c in combinations})
+        generator = image_data_generator()
+        trained_epochs = 0
+
+        for budget in budgets:
+            val_acc = {}
+            for candidate in candidates:
+                learning_rate, batch_size, reg_penalty, momentum = candidate
+                combination = (learning_rate, batch_size, reg_penalty, budget, momentum)
+                val_acc[candidate] = []
+
+                for j, (train_index, test_index) in enumerate(folds):
+                    entry = done.get((combination, j + 1))
+                    if entry is not None:
+                        val_acc[candidate].append(entry["val_acc"])
+                        continue
+
+                    X_train, X_val = X[train_index], X[test_index]
+                    y_train, y_val = Y[train_index], Y[test_index]
+                    model = self.build_model(input_dim, combination, loss_for(Y))
+                    previous = rung_weights_path(folder, candidate, j, trained_epochs)
+                    if trained_epochs:
+                        model.load_weights(previous)
+                    model.fit(
+                        training_flow(
+                            X_train, y_train, batch_size, pipeline, generator
+                        ),
+                        steps_per_epoch=len(X_train) // batch_size,
+                        initial_epoch=trained_epochs,
+                        epochs=budget,
+                        validation_data=(X_val, y_val),
+                        validation_steps=len(X_val) // batch_size,
+                    )
+                    model.save_weights(
+                        rung_weights_path(folder, candidate, j, budget)
+                    )
+                    val_acc[candidate].append(model.evaluate(X_val, y_val)[1])
+                    loss, acc = model.evaluate(X_test, y_test)
+                    append_journal(
+                        journal,
+                        {
+                            "combination": list(combination),
+                            "fold": j + 1,
+                            "loss": loss,
+                            "acc": acc,
+                            "epoch_stopped": budget,
+                            "val_acc": val_acc[candidate][-1],
+                            "seconds": time.time() - start,
+                            **definition,
+                        },
+                    )
+                    # the journaled round replaces the weights it started from
+                    remove_file(previous)
+
+            if len(candidates) == 1 or budget == budgets[-1]:
+                break
+
+            ranked = sorted(candidates, key=lambda c: -sum(val_acc[c]))
+            candidates = ranked[: max(1, len(candidates) // eta)]
+            for candidate in ranked[len(candidates) :]:
+                for j in range(len(folds)):
+                    remove_file(rung_weights_path(folder, candidate, j, budget))
+            trained_epochs = budget
+
+        print("successive halving finished in {:.0f}s".format(time.time() - start))
+        summary = summarize_journal(read_journal(journal, definition), len(folds))
+        summary.to_csv(filename, sep=";")
+        return summary
+
+    def build_model(self, input_dim, combination, loss="categorical_crossentropy"):
+        """[summary]
+
+        Args:
+            input_dim ([type]): input dimension
+            combination ([type]): learning rate, batch size, reg_penalty, epochs and
+                momentum
+            loss (str, optional): see _utility.loss_for. Defaults to
+                "categorical_crossentropy".
+
+        Returns:
+            compiled wide residual network of the combination
+        """
+        wresnet_ins = WideResidualNetwork(
+            input_dim,
+            combination[2],
+            combination[4],
+            nb_classes=4,
+            N=2,
+            k=2,
+            dropout=0.0,
+        )
+        model = wresnet_ins.create_wide_residual_network()
+        model.compile(
+            loss=loss,
+            optimizer=SGD(lr=combination[0], momentum=combination[4]),
+            metrics=["acc"],
+        )
+        return model
+
+
+def journal_path(filename):
+    """returns the journal file of a summary csv file"""
+    return os.path.splitext(filename)[0] + ".journal.jsonl"
+
+
+def weights_folder(filename, definition):
+    """returns the folder of the successive halving weights of a summary csv file"""
+    return "{}_weights_folds{}_seed{}".format(
+        os.path.splitext(filename)[0], definition["n_folds"], definition["seed"]
+    )
+
+
+def rung_weights_path(folder, candidate, fold, epochs):
+    """weights file of a candidate (learning rate, batch size, reg_penalty,
+    momentum) trained for epochs on a fold"""
+    return os.path.join(
+        folder, "{}_{}_{}_{}_fold{}_epochs{}.h5".format(*candidate, fold, epochs)
+    )
+
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def fold_definition(folds, seed=None):
+    """returns the journal key of a set of folds, their number and split seed"""
+    return {"n_folds": len(folds), "seed": seed}
+
+
+def read_journal(journal, definition=None):
+    """[summary]
+
+    Args:
+        journal (str): journal file
+        definition (dict, optional): only the results of these folds, see
+            fold_definition. Defaults to None, all results.
+
+    Returns:
+        list of the journaled (combination, fold) results. A line which was cut
+        off by a crash is skipped.
+    """
+    entries = []
+    if not os.path.exists(journal):
+        return entries
+
+    with open(journal) as file_:
+        for line in file_:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if definition is None or all(
+                entry.get(key) == value for key, value in definition.items()
+            ):
+                entries.append(entry)
+    return entries
+
+
+def append_journal(journal, entry):
+    """appends one result to the journal and flushes it to disk
+
+    A last line which was cut off by a crash is terminated first, so that the
+    result is written on a line of its own.
+    """
+    with open(journal, "a+b") as file_:
+        if file_.seek(0, os.SEEK_END) > 0:
+            file_.seek(-1, os.SEEK_END)
+            if file_.read(1) != b"\n":
+                file_.write(b"\n")
+        file_.write((json.dumps(entry) + "\n").encode())
+        file_.flush()
+        os.fsync(file_.fileno())
+
+
+def summarize_journal(entries, n_splits=N_SPLITS):
+    """[summary]
+
+    Args:
+        entries ([type]): journaled results, see read_journal
+        n_splits (int, optional): folds of a combination. Defaults to N_SPLITS.
+
+    Returns:
+        DataFrame: one row per combination which finished all folds, with the
+        columns of the grid_16_*.csv files
+    """
+    metrics = {}
+    for entry in entries:
+        metrics.setdefault(tuple(entry["combination"]), {})[entry["fold"]] = entry
+
+    rows = []
+    for combination, folds in metrics.items():
+        if len(folds) < n_splits:
+            continue
+        row = {
+            "momentum": combination[4],
+            "learning rate": combination[0],
+            "batch size": combination[1],
+            "reg_penalty": combination[2],
+        }
+        for fold in range(1, n_splits + 1):
+            row["epoch_stopped" + str(fold)] = folds[fold]["epoch_stopped"]
+            row["loss" + str(fold)] = folds[fold]["loss"]
+            row["acc" + str(fold)] = folds[fold]["acc"]
+        rows.append(row)
+
+    columns = ["momentum", "learning rate", "batch size"]
+    for fold in range(1, n_splits + 1):
+        columns += ["loss" + str(fold), "acc" + str(fold)]
+    # column order of the existing grid_16_2.csv
+    columns += ["epoch_stopped" + str(fold) for fold in range(1, n_splits + 1)]
+    columns += ["reg_penalty"]
+
+    return pd.DataFrame(rows, columns=columns)
 
 
 if __name__ == "__main__":
@@ -126,12 +406,40 @@ if __name__ == "__main__":
         momentum=momentum,
     )
     combinations = list(product(*param_grid.values()))
-    X, Y = preprocessing()
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, Y, test_size=0.05, shuffle=True
+    # int8 class indices, the models compile with the sparse cross-entropy
+    # person-grouped test part and folds of the stored split, the same test persons
+    # as the training scripts
+    data, folds = load_folds("data.pz", sparse=True, n_folds=N_SPLITS, seed=SPLIT_SEED)
+    X_train, X_test, y_train, y_test = (
+        data["xtrain"],
+        data["xtest"],
+        data["ytrain"],
+        data["ytest"],
     )
     print(combinations)
     instance = ModelSelection()
-    instance.KFold_GridSearchCV(
-        input_dim, X_train, y_train, X_test, y_test, combinations, "grid_16.csv"
-    )
+    # "halving" runs the successive halving search instead of the full grid
+    if sys.argv[1:] == ["halving"]:
+        instance.KFold_SuccessiveHalving(
+            input_dim,
+            X_train,
+            y_train,
+            X_test,
+            y_test,
+            combinations,
+            "sh_16.csv",
+            folds=folds,
+            seed=SPLIT_SEED,
+        )
+    else:
+        instance.KFold_GridSearchCV(
+            input_dim,
+            X_train,
+            y_train,
+            X_test,
+            y_test,
+            combinations,
+            "grid_16.csv",
+            folds=folds,
+            seed=SPLIT_SEED,
+        )
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+CACHE_DIR = ".data_cache"
+INDEX_FILE = "index.json"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """[summary]
+
+    Args:
+        path (str): file to hash
+        chunk_size (int, optional): bytes read at once. Defaults to 1 MiB.
+
+    Returns:
+        sha256 hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file_:
+        for chunk in iter(lambda: file_.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(source, size, cache_dir=CACHE_DIR):
+    """returns the cache key of a source file and a target resolution
+
+    The content hash is only recomputed when the size or modification time of
+    the source file changes, so opening a warm cache does not read the source.
+
+    Args:
+        source (str): data.pz or data.hkl file
+        size (tuple): target resolution, None for files which are already resized
+        cache_dir (str, optional): cache folder. Defaults to CACHE_DIR.
+
+    Returns:
+        key (str): name of the cache entry
+    """
+    stat = os.stat(source)
+    stamp = "{}:{}:{}".format(os.path.abspath(source), stat.st_size, stat.st_mtime_ns)
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as file_:
+            index = json.load(file_)
+
+    if stamp not in index:
+        index[stamp] = file_hash(source)
+        os.makedirs(cache_dir, exist_ok=True)
+        _atomic_write_json(index_path, index)
+
+    resolution = "x".join(str(s) for s in size) if size is not None else "raw"
+    return "{}_{}".format(index[stamp][:16], resolution)
+
+
+def _materialize(entry, build):
+    """builds a cache entry in a temporary folder and moves it into place at once,
+    so that concurrent processes never see a half written entry
+    """
+    os.makedirs(os.path.dirname(entry) or ".", exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry) or ".")
+    try:
+        meta = build(tmp)
+        with open(os.path.join(tmp, "meta.json"), "w") as file_:
+            json.dump(meta, file_)
+        os.rename(tmp, entry)
+    except OSError:
+        # another process finished the same entry first
+        if not os.path.exists(entry):
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _open(entry, name):
+    return np.load(os.path.join(entry, name + ".npy"), mmap_mode="r")
+
+
+def _atomic_write_json(path, content):
+    tmp = path + ".{}.tmp".format(os.getpid())
+    with open(tmp, "w") as file_:
+        json.dump(content, file_)
+    os.replace(tmp, path)
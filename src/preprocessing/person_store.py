@@ -0,0 +1,301 @@
+import gzip
+import json
+import os
+import pickle
+
+import numpy as np
+from sklearn.preprocessing import LabelEncoder
+from tensorflow.keras import backend as K
+
+from dataset_cache import _atomic_write_json, _materialize, _open, cache_key
+from resize import resize_crops
+
+STORE_DIR = ".person_store"
+INDEX_FILE = "index.json"
+SPLIT_DIR = "splits"
+
+
+def open_store(source="data.pz", size=(32, 32), store_dir=STORE_DIR):
+    """returns the person-sharded store of data.pz, built on the first call
+
+    The build decompresses data.pz once and writes one shard folder per person
+    with its resized float32 images and int8 class indices. Later calls, also from
+    other processes, only read the index.
+
+    Args:
+        source (str, optional): zipped pickle file. Defaults to "data.pz".
+        size (tuple, optional): target resolution. Defaults to (32, 32).
+        store_dir (str, optional): store folder. Defaults to STORE_DIR.
+
+    Returns:
+        PersonStore
+    """
+    entry = os.path.join(store_dir, cache_key(source, size, store_dir))
+    if not os.path.exists(entry):
+        _materialize(entry, lambda tmp: _build_store(source, size, tmp))
+    return PersonStore(entry)
+
+
+def load_folds(source="data.pz", parts=("train", "test"), sparse=False, **kwargs):
+    """returns parts of the stored person-grouped split and the folds of its train part
+
+    The training and evaluation scripts load their data here, so that they share
+    the test persons and the folds and no person is in two of them.
+
+    Args:
+        source (str, optional): zipped pickle file. Defaults to "data.pz".
+        parts (tuple, optional): parts to load. Defaults to ("train", "test").
+        sparse (bool, optional): int8 class indices. Defaults to False.
+        **kwargs: arguments of PersonStore.split
+
+    Returns:
+        data, folds: see PersonStore.load_split and PersonStore.fold_indices
+    """
+    store = open_store(source)
+    data = store.load_split(parts, sparse, **kwargs)
+    return data, store.fold_indices(store.split(**kwargs))
+
+
+def split_name(test_size=0.05, val_size=0.1, n_folds=10, seed=42):
+    """returns the name of a split under SPLIT_DIR, see PersonStore.split"""
+    return "test{}_val{}_folds{}_seed{}".format(test_size, val_size, n_folds, seed)
+
+
+class PersonStore(object):
+    """
+    Memory-mapped shards of one person each, with an index of the persons, their
+    shard folders and their number of images.
+    """
+
+    def __init__(self, entry):
+        self.entry = entry
+        with open(os.path.join(entry, INDEX_FILE)) as file_:
+            self.index = json.load(file_)
+        self.classes = self.index["classes"]
+
+    @property
+    def persons(self):
+        return list(self.index["persons"])
+
+    def count(self, person):
+        return self.index["persons"][str(person)]["count"]
+
+    def load_person(self, person, sparse=False):
+        """[summary]
+
+        Args:
+            person: person ID
+            sparse (bool, optional): int8 class indices instead of one-hot labels.
+                Defaults to False.
+
+        Returns:
+            x, y: memory-mapped images and the labels of one person, only its
+            shard is opened
+        """
+        folder = os.path.join(self.entry, self.index["persons"][str(person)]["shard"])
+        x = np.load(os.path.join(folder, "x.npy"), mmap_mode="r")
+        y = np.load(os.path.join(folder, "y.npy"), mmap_mode="r")
+        if not sparse:
+            y = np.eye(len(self.classes), dtype="float32")[y]
+        return x, y
+
+    def split(self, test_size=0.05, val_size=0.1, n_folds=10, seed=42):
+        """returns the person-grouped split, computed once and stored in the store
+
+        Args:
+            test_size (float, optional): fraction of images of the test persons.
+                Defaults to 0.05.
+            val_size (float, optional): fraction of images of the validation
+                persons. Defaults to 0.1.
+            n_folds (int, optional): person-grouped folds of the training persons.
+                Defaults to 10.
+            seed (int, optional): shuffle of the persons. Defaults to 42.
+
+        Returns:
+            dict with the train, val and test persons and the persons of the folds
+        """
+        name = split_name(test_size, val_size, n_folds, seed) + ".json"
+        path = os.path.join(self.entry, SPLIT_DIR, name)
+        if os.path.exists(path):
+            with open(path) as file_:
+                return json.load(file_)
+
+        split = group_split(
+            {person: self.count(person) for person in self.persons},
+            test_size,
+            val_size,
+            n_folds,
+            seed,
+        )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _atomic_write_json(path, split)
+        return split
+
+    def load_split(self, parts=("train", "val", "test"), sparse=False, **kwargs):
+        """returns parts of a split as memory-mapped arrays
+
+        Every part is written once as contiguous .npy files next to the split, from
+        the shards of its persons only. Later calls, also from other processes such
+        as the fold workers, map these files and share their pages.
+
+        Args:
+            parts (tuple, optional): parts of the split to load. Defaults to
+                ("train", "val", "test").
+            sparse (bool, optional): int8 class indices. Defaults to False.
+            **kwargs: arguments of split
+
+        Returns:
+            data: dict with x<part>, y<part> and person<part> of every part
+        """
+        split = self.split(**kwargs)
+        data = {}
+        for part in parts:
+            entry = os.path.join(
+                self.entry, SPLIT_DIR, split_name(**kwargs) + "_" + part
+            )
+            if not os.path.exists(entry):
+                persons = split[part]
+                _materialize(entry, lambda tmp: self._build_part(persons, tmp))
+            data["x" + part] = _open(entry, "x")
+            data["y" + part] = (
+                _open(entry, "y") if sparse else _open_onehot(entry, len(self.classes))
+            )
+            data["person" + part] = _open(entry, "person")
+        return data
+
+    def _build_part(self, persons, folder):
+        counts = [self.count(person) for person in persons]
+        image_shape = self.load_person(persons[0], sparse=True)[0].shape[1:]
+        x = np.lib.format.open_memmap(
+            os.path.join(folder, "x.npy"),
+            mode="w+",
+            dtype="float32",
+            shape=(sum(counts),) + image_shape,
+        )
+        y = np.empty(sum(counts), dtype="int8")
+        start = 0
+        for person, count in zip(persons, counts):
+            x[start : start + count], y[start : start + count] = self.load_person(
+                person, sparse=True
+            )
+            start += count
+        del x
+        np.save(os.path.join(folder, "y.npy"), y)
+        person = np.repeat(np.array([str(p) for p in persons]), counts)
+        np.save(os.path.join(folder, "person.npy"), person)
+        return {"persons": list(persons)}
+
+    def fold_indices(self, split):
+        """returns the (train, val) indices of the folds of a split, positions in
+        the train part of load_split, in the format of fold_scheduler.fold_indices
+        """
+        offsets, start = {}, 0
+        for person in split["train"]:
+            offsets[person] = np.arange(start, start + self.count(person))
+            start += self.count(person)
+
+        folds = []
+        for fold in split["folds"]:
+            val = np.concatenate([offsets[person] for person in fold])
+            train = np.setdiff1d(np.arange(start), val)
+            folds.append((train, val))
+        return folds
+
+
+def _open_onehot(entry, n_classes):
+    """maps the one-hot labels of the int8 class indices, written on first use"""
+    path = os.path.join(entry, "y.onehot.npy")
+    if not os.path.exists(path):
+        tmp = path + ".{}.tmp.npy".format(os.getpid())
+        np.save(tmp, np.eye(n_classes, dtype="float32")[_open(entry, "y")])
+        os.replace(tmp, path)
+    return np.load(path, mmap_mode="r")
+
+
+def group_split(counts, test_size=0.05, val_size=0.1, n_folds=10, seed=42):
+    """[summary]
+
+    Args:
+        counts (dict): number of images of every person
+        test_size (float, optional): Defaults to 0.05.
+        val_size (float, optional): Defaults to 0.1.
+        n_folds (int, optional): Defaults to 10.
+        seed (int, optional): Defaults to 42.
+
+    Returns:
+        dict with the persons of the parts. Shuffled persons fill the test part
+        until it holds test_size of the images, then the validation part, the rest
+        is training. The training persons are dealt into n_folds folds of about
+        the same number of images.
+    """
+    persons = sorted(counts)
+    np.random.RandomState(seed).shuffle(persons)
+    total = sum(counts.values())
+
+    parts = {"test": [], "val": [], "train": []}
+    filled = {"test": 0, "val": 0}
+    for person in persons:
+        if filled["test"] < test_size * total:
+            part = "test"
+        elif filled["val"] < val_size * total:
+            part = "val"
+        else:
+            part = "train"
+        parts[part].append(person)
+        if part in filled:
+            filled[part] += counts[person]
+
+    folds = [[] for _ in range(n_folds)]
+    sizes = [0] * n_folds
+    for person in sorted(parts["train"], key=lambda p: -counts[p]):
+        smallest = int(np.argmin(sizes))
+        folds[smallest].append(person)
+        sizes[smallest] += counts[person]
+    parts["folds"] = [fold for fold in folds if fold]
+    parts["seed"] = seed
+    return parts
+
+
+def _build_store(source, size, folder):
+    with open(source, "rb") as file_:
+        with gzip.GzipFile(fileobj=file_) as gzf:
+            data = pickle.load(gzf, encoding="latin1", fix_imports=True)
+
+    labelencoder = LabelEncoder()
+    encoded = labelencoder.fit_transform([row["label"] for row in data])
+
+    by_person = {}
+    for i, row in enumerate(data):
+        by_person.setdefault(str(row["person"]), []).append(i)
+
+    width, height = size
+    if K.image_data_format() == "channels_first":
+        image_shape = (1, height, width)
+    else:
+        image_shape = (height, width, 1)
+
+    persons = {}
+    for number, (person, rows) in enumerate(sorted(by_person.items())):
+        shard = "person_{:04d}".format(number)
+        os.makedirs(os.path.join(folder, shard))
+        x = np.lib.format.open_memmap(
+            os.path.join(folder, shard, "x.npy"),
+            mode="w+",
+            dtype="float32",
+            shape=(len(rows),) + image_shape,
+        )
+        resize_crops([data[i]["crop"] for i in rows], size, out=x)
+        del x
+        np.save(os.path.join(folder, shard, "y.npy"), encoded[rows].astype("int8"))
+        persons[person] = {"shard": shard, "count": len(rows)}
+
+    _atomic_write_json(
+        os.path.join(folder, INDEX_FILE),
+        {
+            "source": source,
+            "size": list(size),
+            "classes": list(labelencoder.classes_),
+            "persons": persons,
+        },
+    )
+    return {"source": source, "size": list(size)}
@@ -1,4 +1,3 @@
-import cv2
 from sklearn.model_selection import train_test_split
 import pandas as pd
 import numpy as np
@@ -6,42 +5,62 @@ from sklearn.preprocessing import LabelEncoder
 from tensorflow.keras.utils import to_categorical
 from tensorflow.keras import backend as K
 
+from resize import resize_crops
 
-def preprocessing_data(data):
+
+def preprocessing_data(data, sparse=False):
     """[summary]
 
     Args:
         data ([type]): consists of image(x) and label(y)
+        sparse (bool, optional): int8 class indices, see transform_output.
+            Defaults to False.
 
     Returns:
         transformed_x: resized x
         transformed_y: label transformed
     """
-    x_input = []
+    crops = []
     y_input = []
 
     for row in data:
-        x_input.append(cv2.resize(row["crop"], (32, 32)))
+        crops.append(row["crop"])
         y_input.append(row["label"])
 
-    x_input = np.array(x_input)
-
-    transformed_x = transform_imput(x_input.astype("float32"))
+    transformed_x = transform_crops(crops)
 
-    transformed_y = transform_output(y_input)
+    transformed_y = transform_output(y_input, sparse)
 
     return transformed_x, transformed_y
 
 
-def transform_output(output):
+def transform_crops(crops, size=(32, 32)):
+    """resizes raw eye crops and reshapes them to the input of the models
+
+    Args:
+        crops (list): 2D grayscale crops of any size
+        size (tuple, optional): size of the model input. Defaults to (32, 32).
+
+    Returns:
+        x_input: float32 tensor of the resized crops
+    """
+    return transform_input(resize_crops(crops, size))
+
+
+def transform_output(output, sparse=False):
     """[summary]
 
     Args:
         output ([type]): label of images
+        sparse (bool, optional): return int8 class indices instead of one-hot
+            labels, for the sparse cross-entropy. Defaults to False.
 
     Returns:
         y_cat: categorial label
     """
+    if sparse:
+        return LabelEncoder().fit_transform(output).astype("int8")
+
     labelencoder = LabelEncoder()
     y_df = pd.DataFrame(output, columns=["Label"])
     y_df["Encoded"] = labelencoder.fit_transform(y_df["Label"])
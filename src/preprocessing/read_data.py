@@ -1,7 +1,8 @@
 import gzip
 import pickle
 import numpy as np
-import cv2
+
+from resize import resize_crops
 
 
 def read_data():
@@ -14,14 +15,10 @@ def read_data():
     with open("data.pz", "rb") as file_:
         with gzip.GzipFile(fileobj=file_) as gzf:
             data = pickle.load(gzf, encoding="latin1", fix_imports=True)
-    new_data_x = []
-
-    y_data = []
-
-    for row in data:
-        new_data_x.append(cv2.resize(row["crop"], (32, 32)))
-        y_data.append(row["label"])
+    y_data = [row["label"] for row in data]
 
-    new_data_x = np.array(new_data_x)
+    # same values as cv2.resize of every crop, in cv2's output dtype
+    new_data_x = np.empty((len(data), 32, 32), dtype=data[0]["crop"].dtype)
+    resize_crops([row["crop"] for row in data], (32, 32), out=new_data_x)
 
     return new_data_x, y_data
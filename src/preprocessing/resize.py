@@ -0,0 +1,70 @@
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# most channels cv2.resize accepts in one image (CV_CN_MAX)
+MAX_CHANNELS = 512
+
+
+def group_by_shape(crops):
+    """returns the indices of the crops of every source shape"""
+    groups = collections.defaultdict(list)
+    for i, crop in enumerate(crops):
+        groups[np.shape(crop)].append(i)
+    return groups
+
+
+def resize_crops(crops, size=(32, 32), out=None, n_threads=None):
+    """resizes crops of varying source sizes into one preallocated tensor
+
+    Crops with the same 2D source shape are stacked along the channel axis and
+    resized with one cv2.resize call per MAX_CHANNELS crops, which gives the same
+    result as resizing them one by one. The stacks are resized in a thread pool,
+    cv2 releases the GIL, and written straight into their rows of out.
+
+    Args:
+        crops (list): 2D grayscale crops
+        size (tuple, optional): (width, height) as in cv2.resize. Defaults to
+            (32, 32).
+        out (np.ndarray, optional): preallocated output of len(crops) * height *
+            width values, e.g. a memmap shaped like transform_input. Defaults to
+            None, a new float32 array of shape (len(crops), height, width).
+        n_threads (int, optional): resize threads. Defaults to the CPU count.
+
+    Returns:
+        out: the resized crops
+    """
+    width, height = size
+    if out is None:
+        out = np.empty((len(crops), height, width), dtype="float32")
+    rows = out.reshape(len(crops), height, width)
+
+    tasks = []
+    for shape, index in group_by_shape(crops).items():
+        if len(shape) != 2:
+            # multi-channel crops are resized one by one
+            tasks += [[i] for i in index]
+            continue
+        tasks += [
+            index[start : start + MAX_CHANNELS]
+            for start in range(0, len(index), MAX_CHANNELS)
+        ]
+
+    def resize(index):
+        if len(index) == 1:
+            rows[index[0]] = cv2.resize(crops[index[0]], size).reshape(height, width)
+            return
+        stack = np.stack([crops[i] for i in index], axis=-1)
+        resized = cv2.resize(stack, size)
+        rows[index] = np.moveaxis(resized, -1, 0)
+
+    with ThreadPoolExecutor(n_threads or os.cpu_count()) as pool:
+        # list() re-raises the errors of the threads
+        list(pool.map(resize, tasks))
+
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
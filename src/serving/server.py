@@ -0,0 +1,256 @@
+import argparse
+import collections
+import io
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from model_factory import load_model
+from preprocessing import transform_crops
+
+MAX_BATCH_SIZE = 64
+# seconds the first request of a batch waits for others
+MAX_DELAY = 0.005
+# latencies kept for the percentiles
+LATENCY_WINDOW = 10000
+
+
+class Metrics(object):
+    """
+    Thread-safe request counters and a sliding window of request latencies.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.crops = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.crops += size
+
+    def record_request(self, latency, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.latencies.append(latency)
+
+    def summary(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            uptime = time.perf_counter() - self.started
+            summary = {
+                "requests": self.requests,
+                "crops": self.crops,
+                "batches": self.batches,
+                "errors": self.errors,
+                "mean_batch_size": self.crops / max(self.batches, 1),
+                "requests_per_second": self.requests / uptime,
+                "crops_per_second": self.crops / uptime,
+            }
+        if len(latencies):
+            summary["latency_ms_p50"] = float(np.percentile(latencies, 50))
+            summary["latency_ms_p99"] = float(np.percentile(latencies, 99))
+        return summary
+
+
+class MicroBatcher(object):
+    """
+    Groups single inputs of concurrent callers into batches of one predict call.
+
+    A batch is run once it holds max_batch_size inputs or max_delay seconds after
+    its first input arrived, whichever comes first. The model is only called from
+    the batching thread.
+
+    Args:
+        predict (callable): predict(x_batch) returns one output row per input
+        max_batch_size (int, optional): Defaults to MAX_BATCH_SIZE.
+        max_delay (float, optional): seconds. Defaults to MAX_DELAY.
+        metrics (Metrics, optional): records the batch sizes. Defaults to None.
+    """
+
+    def __init__(
+        self, predict, max_batch_size=MAX_BATCH_SIZE, max_delay=MAX_DELAY, metrics=None
+    ):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.metrics = metrics
+        self.inputs = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, x):
+        """returns a Future of the output row of a single input"""
+        future = Future()
+        self.inputs.put((x, future))
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.inputs.get()]
+            deadline = time.perf_counter() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.inputs.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        try:
+            outputs = np.asarray(self.predict(np.stack([x for x, _ in batch])))
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        if self.metrics is not None:
+            self.metrics.record_batch(len(batch))
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
+
+
+def read_crops(body, content_type):
+    """[summary]
+
+    Args:
+        body (bytes): request body
+        content_type (str): "application/x-npy" for an np.save'd array of crops (a
+            single 2D crop or a stack of equally sized crops), json otherwise:
+            {"crops": [crop, ...]} with every crop a nested list
+
+    Returns:
+        list of 2D crops
+    """
+    if content_type == "application/x-npy":
+        crops = np.load(io.BytesIO(body), allow_pickle=False)
+        return [crops] if crops.ndim == 2 else list(crops)
+    return [np.asarray(crop, dtype="uint8") for crop in json.loads(body)["crops"]]
+
+
+def make_handler(batcher, metrics):
+    class PredictionHandler(BaseHTTPRequestHandler):
+        """POST /predict with crops, GET /metrics"""
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            self.send_json(200, metrics.summary())
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self.send_error(404)
+                return
+            start = time.perf_counter()
+            try:
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                crops = read_crops(body, self.headers.get("Content-Type"))
+                x = transform_crops(crops)
+            except Exception as error:
+                # malformed request
+                metrics.record_request(time.perf_counter() - start, error=True)
+                self.send_json(400, {"error": str(error)})
+                return
+            try:
+                # the crops of one request are batched together with other requests
+                futures = [batcher.submit(x_crop) for x_crop in x]
+                probabilities = np.array([future.result() for future in futures])
+            except Exception as error:
+                # failure of the model or the batcher
+                metrics.record_request(time.perf_counter() - start, error=True)
+                self.send_json(500, {"error": str(error)})
+                return
+            metrics.record_request(time.perf_counter() - start)
+            self.send_json(
+                200,
+                {
+                    "labels": np.argmax(probabilities, axis=-1).tolist(),
+                    "probabilities": probabilities.tolist(),
+                },
+            )
+
+        def send_json(self, status, content):
+            body = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictionHandler
+
+
+def serve(
+    model,
+    host="127.0.0.1",
+    port=8000,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_delay=MAX_DELAY,
+):
+    """serves the predictions of a model until interrupted"""
+    metrics = Metrics()
+    batcher = MicroBatcher(model.predict_on_batch, max_batch_size, max_delay, metrics)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, metrics))
+    print("serving on http://{}:{}".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(metrics.summary(), indent=4))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="HTTP eye-state classification with micro-batching"
+    )
+    parser.add_argument("weights", help="e.g. ResNet/ResNet_0.h5")
+    parser.add_argument(
+        "--architecture", default="ResNet", choices=["ResNet", "Parseval"]
+    )
+    parser.add_argument("--k", type=int, default=1, help="width of the networks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument(
+        "--max-delay-ms", type=float, default=1000 * MAX_DELAY, help="batching delay"
+    )
+    arguments = parser.parse_args()
+
+    model = load_model(
+        arguments.weights,
+        arguments.architecture,
+        (32, 32, 1),
+        0.0001,
+        0.9,
+        nb_classes=4,
+        N=2,
+        k=arguments.k,
+        dropout=0.0,
+    )
+    serve(
+        model,
+        arguments.host,
+        arguments.port,
+        arguments.max_batch_size,
+        arguments.max_delay_ms / 1000,
+    )
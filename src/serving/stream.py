@@ -0,0 +1,209 @@
+import argparse
+import queue
+import threading
+import time
+
+import numpy as np
+
+from model_factory import load_model
+from person_store import open_store
+from preprocessing import transform_crops
+
+BATCH_SIZE = 64
+# seconds a partial batch waits for more crops of a slow source
+MAX_DELAY = 0.05
+# crops read ahead of the classifier, bounds the memory of the pipeline
+BUFFER_SIZE = 256
+
+_END = object()
+
+
+class _Reader(object):
+    """
+    Reads a source iterator in a thread into a bounded queue. The thread blocks
+    while the queue is full, so a slow classifier holds back the source.
+    """
+
+    def __init__(self, source, buffer_size):
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(source,), daemon=True)
+        self.thread.start()
+
+    def run(self, source):
+        try:
+            for item in source:
+                if not self.put(item):
+                    return
+        except Exception as error:
+            self.put(error)
+        self.put(_END)
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def stop(self):
+        self.stopped.set()
+
+
+def batches(
+    source, batch_size=BATCH_SIZE, max_delay=MAX_DELAY, buffer_size=BUFFER_SIZE
+):
+    """groups a stream into lists of at most batch_size items
+
+    A batch is yielded when it is full, or max_delay seconds after its first item
+    when the source is slower than the classifier.
+
+    Args:
+        source (iterable): stream of items
+        batch_size (int, optional): Defaults to BATCH_SIZE.
+        max_delay (float, optional): seconds. Defaults to MAX_DELAY.
+        buffer_size (int, optional): items read ahead. Defaults to BUFFER_SIZE.
+    """
+    reader = _Reader(source, buffer_size)
+    try:
+        while True:
+            item = reader.queue.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            batch = [item]
+            deadline = time.perf_counter() + max_delay
+            end = False
+            while len(batch) < batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    item = reader.queue.get(timeout=max(timeout, 0))
+                except queue.Empty:
+                    break
+                if item is _END:
+                    end = True
+                    break
+                if isinstance(item, Exception):
+                    yield batch
+                    raise item
+                batch.append(item)
+            yield batch
+            if end:
+                return
+    finally:
+        reader.stop()
+
+
+def classify_stream(
+    crops,
+    predict,
+    batch_size=BATCH_SIZE,
+    max_delay=MAX_DELAY,
+    buffer_size=BUFFER_SIZE,
+    size=(32, 32),
+):
+    """classifies a stream of eye crops batch by batch and yields it frame by frame
+
+    Only buffer_size crops, one batch and the crops of one frame are held in
+    memory. The source is read ahead in a thread which blocks when the classifier
+    falls behind. Batches are cut independently of the frames, a frame is yielded
+    once the first crop of the next frame or the end of the stream is classified.
+
+    Args:
+        crops (iterable): (frame, timestamp, person, crop) of every eye crop, the
+            crops of a frame one after another
+        predict (callable): predict(x_batch) returns the class probabilities, e.g.
+            model.predict_on_batch
+        batch_size (int, optional): Defaults to BATCH_SIZE.
+        max_delay (float, optional): see batches. Defaults to MAX_DELAY.
+        buffer_size (int, optional): see batches. Defaults to BUFFER_SIZE.
+        size (tuple, optional): size of the model input. Defaults to (32, 32).
+
+    Yields:
+        dict with the frame, its timestamp and the person, the label and its
+        probability of every crop of the frame
+    """
+    frame = None
+    for batch in batches(crops, batch_size, max_delay, buffer_size):
+        x_batch = transform_crops([crop for _, _, _, crop in batch], size)
+        probabilities = np.asarray(predict(x_batch))
+        labels = np.argmax(probabilities, axis=-1)
+        for (frame_id, timestamp, person, _), label, probability in zip(
+            batch, labels, probabilities
+        ):
+            if frame is not None and frame["frame"] != frame_id:
+                yield frame
+                frame = None
+            if frame is None:
+                frame = {"frame": frame_id, "timestamp": timestamp, "crops": []}
+            frame["crops"].append(
+                {
+                    "person": person,
+                    "label": int(label),
+                    "probability": float(probability[label]),
+                }
+            )
+    if frame is not None:
+        yield frame
+
+
+def replay(source="data.pz", fps=None):
+    """replays the crops of a data.pz file as a stream, one crop per frame
+
+    The crops are read lazily from the memory-mapped shards of the person store
+    of source, person by person, so only the pages of the current crops are
+    loaded. The store is built on the first call, see open_store.
+
+    Args:
+        source (str, optional): Defaults to "data.pz".
+        fps (float, optional): frames per second. Defaults to None, as fast as read.
+
+    Yields:
+        (frame, timestamp, person, crop)
+    """
+    store = open_store(source)
+    frame = 0
+    for person in store.persons:
+        x, _ = store.load_person(person, sparse=True)
+        for crop in x:
+            if fps:
+                time.sleep(1 / fps)
+            # a 2D crop like the crops of data.pz
+            yield frame, time.time(), person, crop.reshape(crop.shape[:2])
+            frame += 1
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="eye states of a stream of crops")
+    parser.add_argument("weights", help="e.g. ResNet/ResNet_0.h5")
+    parser.add_argument(
+        "--architecture", default="ResNet", choices=["ResNet", "Parseval"]
+    )
+    parser.add_argument("--k", type=int, default=1, help="width of the networks")
+    parser.add_argument("--source", default="data.pz")
+    parser.add_argument("--fps", type=float, default=None)
+    arguments = parser.parse_args()
+
+    model = load_model(
+        arguments.weights,
+        arguments.architecture,
+        (32, 32, 1),
+        0.0001,
+        0.9,
+        nb_classes=4,
+        N=2,
+        k=arguments.k,
+        dropout=0.0,
+    )
+    start = time.perf_counter()
+    n_crops = 0
+    for frame in classify_stream(
+        replay(arguments.source, arguments.fps), model.predict_on_batch
+    ):
+        n_crops += len(frame["crops"])
+        print(frame)
+    print("{:.1f} crops/sec".format(n_crops / (time.perf_counter() - start)))
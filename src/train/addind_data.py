@@ -14,7 +14,6 @@ from sklearn.preprocessing import LabelEncoder
 from tensorflow.keras.utils import to_categorical
 from sklearn.model_selection import KFold
 import gzip
-from train_utily import noise
 import warnings
 
 warnings.filterwarnings("ignore")
@@ -23,24 +22,34 @@ import tensorflow
 print("\nTensorflow Version: " + tf.__version__)
 from _utility import lrate, get_adversarial_examples, print_test
 from wresnet import WideResidualNetwork
+from augmentation import NoiseSampler
+from person_store import load_folds, open_store
+from fold_scheduler import FoldScheduler, augmented_folds, fold_indices
+from training import fit_fold, fit_noise_fold
+from model_factory import load_model
+from ae_store import AEStore
+from telemetry import Telemetry, telemetry_path
+import functools
 import os
+import time
 
 ## globals
 epsilons = [0.001, 0.003, 0.005, 0.01, 0.03]
 percents = [0.25, 0.5, 0.75, 1.0]
-os.mkdir("RandomnoiseModels")
-os.mkdir("AEModels")
 folder_list = ["RandomnoiseModels", "AEModels"]
+SOURCE_MODEL = "ResNet/ResNet_0.h5"
+# seed of the random noise, the noise of every example is the same in every run
+NOISE_SEED = 0
 
 
-def data_augmentation(epsilon, percent, X, Y, perturbation_type):
+def data_augmentation(percent, X, Y, adversarial):
+    """X and Y followed by the FGSM examples of their first percent
+
+    The random-noise examples are built in the input pipeline, see NoiseSampler.
+    """
     split = int(len(X) * percent)
-    file_name = str(epsilon) + ".pickle"
-    X_adv_percent = list()
-    if perturbation_type[0] == "FGSM":
-        X_adv_percent = get_adversarial_examples(model, X[:split], Y[:split], epsilon)
-    else:
-        X_adv_percent = noise(X[:split], eps=epsilon)
+    # adversarial examples of all of X, every percent is a prefix of them
+    X_adv_percent = adversarial[:split]
 
     aug_X = np.concatenate((X, X_adv_percent), axis=0)
     Y_adv = Y[:split]
@@ -49,67 +58,199 @@ def data_augmentation(epsilon, percent, X, Y, perturbation_type):
     return aug_X, aug_Y
 
 
-def experiments(X, Y, folder):
+def load_training_data():
+    """memory-mapped train part of the stored split, int8 class indices"""
+    data = open_store().load_split(("train",), sparse=True)
+    return data["xtrain"], data["ytrain"]
+
+
+def noise_sampler(data, percent, epsilon):
+    """loader of the fold workers, the NoiseSampler of the clean data of data()"""
+    X, Y = data()
+    return NoiseSampler(X, Y, percent, epsilon, seed=NOISE_SEED)
+
+
+def run_name(folder, epsilon, percent):
+    """returns the prefix of the weights, histories and telemetry of a run"""
+    return folder + "/ResNet_" + str(epsilon) + "_" + str(percent)
+
+
+def experiments(
+    X,
+    Y,
+    folder,
+    n_workers=None,
+    source_model=None,
+    source_path=SOURCE_MODEL,
+    store=None,
+    folds=None,
+    data=None,
+):
+    """[summary]
+
+    Args:
+        n_workers (int, optional): folds trained in parallel processes, 1 trains
+            them in this process. Defaults to default_workers().
+        folds (list, optional): (train, val) indices of X, e.g. the person-grouped
+            folds of load_folds. The perturbed copies follow their input into its
+            fold part. Defaults to ten KFold folds of the augmented data.
+        data (callable, optional): module level loader of X and Y, e.g.
+            load_training_data. The fold workers of the random-noise runs build
+            their NoiseSampler from it. Defaults to None, the sampler is sent to
+            every worker.
+    """
 
     perturbation_type = ["FGSM" if folder == "AEModels" else "Random"]
+    store = store or AEStore()
 
     for epsilon in epsilons:
+        if perturbation_type[0] == "Random":
+            # the noise is added in the input pipeline, X is not copied
+            for percent in percents:
+                sampler = NoiseSampler(X, Y, percent, epsilon, seed=NOISE_SEED)
+                # built again in every worker from the memory-mapped data
+                loader = data and functools.partial(
+                    noise_sampler, data, percent, epsilon
+                )
+                train(
+                    None,
+                    None,
+                    percent,
+                    epsilon,
+                    folder,
+                    n_workers=n_workers,
+                    sampler=sampler,
+                    folds=folds and augmented_folds(folds, len(X), sampler.split),
+                    data=loader,
+                )
+            continue
+
+        # one attack per epsilon, stored and reused by every percent and run
+        start = time.perf_counter()
+        adversarial = store.examples(source_model, source_path, X, Y, epsilon)
+        # shared by the percents, close to zero when the examples are stored
+        attack_seconds = time.perf_counter() - start
         for percent in percents:
-            aug_X, aug_Y = data_augmentation(epsilon, percent, X, Y, perturbation_type)
-            train(aug_X, aug_Y, percent, epsilon, folder)
+            telemetry = Telemetry(telemetry_path(run_name(folder, epsilon, percent)))
+            with telemetry.phase("augmentation"):
+                aug_X, aug_Y = data_augmentation(percent, X, Y, adversarial)
+            telemetry.count(len(aug_X))
+            telemetry.record(
+                "augmentation",
+                epsilon=epsilon,
+                percent=percent,
+                attack_seconds=attack_seconds,
+            )
+            train(
+                aug_X,
+                aug_Y,
+                percent,
+                epsilon,
+                folder,
+                n_workers=n_workers,
+                folds=folds and augmented_folds(folds, len(X), len(aug_X) - len(X)),
+            )
 
 
-def train(X, Y, percent, epsilon, folder):
+def train(
+    X,
+    Y,
+    percent,
+    epsilon,
+    folder,
+    pipeline="generator",
+    n_workers=None,
+    sampler=None,
+    folds=None,
+    data=None,
+):
 
-    "Ten fold CVs of ResNet"
+    """Ten fold CVs of ResNet, folds whose weights already exist are skipped
+
+    With a NoiseSampler, X and Y are unused and the folds split its virtual indices.
+    folds are (train, val) indices of the augmented data, see augmented_folds, and
+    default to ten KFold folds. n_workers defaults to default_workers(), see
+    FoldScheduler. data is a module level loader of what the workers train on, the
+    (X, Y) pair or the NoiseSampler, e.g. noise_sampler. It defaults to the arrays
+    or the sampler, which are then sent to every worker.
+    """
     BS = 64
     init = (32, 32, 1)
     sgd = SGD(lr=0.1, momentum=0.9)
-    kfold = KFold(n_splits=10, random_state=42, shuffle=False)
-    model_name = folder + "/ResNet_" + str(epsilon) + "_" + str(percent)
-
-    for j, (train, val) in enumerate(kfold.split(X)):
-
-        resnet = WideResidualNetwork(
-            init, 0.0001, 0.9, nb_classes=4, N=2, k=1, dropout=0.0
-        )
-        model = resnet.create_wide_residual_network()
+    model_name = run_name(folder, epsilon, percent)
+    resnet = WideResidualNetwork(init, 0.0001, 0.9, nb_classes=4, N=2, k=1, dropout=0.0)
 
-        x_train, y_train = X[train], Y[train]
-        x_val, y_val = X[val], Y[val]
-
-        model.compile(loss="categorical_crossentropy", optimizer=sgd, metrics=["acc"])
-
-        hist = model.fit(
-            generator.flow(x_train, y_train, batch_size=64),
-            steps_per_epoch=len(x_train) // 64,
-            epochs=50,
-            validation_data=(x_val, y_val),
-            validation_steps=len(x_val) // 64,
-            callbacks=[lrate],
-        )
+    def is_done(j):
+        return os.path.exists(model_name + "_" + str(j) + ".h5")
 
+    def on_done(j, history, weights):
         name = model_name + "_" + str(j) + ".h5"
         hist_name = model_name + "_acc" + "_" + str(j) + ".pickle"
         hist_name_loss = model_name + "_loss" + "_" + str(j) + ".pickle"
 
         with open(hist_name, "wb") as f:
-            pickle.dump(hist.history["val_acc"], f)
+            pickle.dump(history["val_acc"], f)
 
         with open(hist_name_loss, "wb") as f:
-            pickle.dump(hist.history["val_loss"], f)
+            pickle.dump(history["val_loss"], f)
 
+        model = resnet.create_wide_residual_network()
+        model.set_weights(weights)
         model.save_weights(name)
 
+    if sampler is None:
+        fit, n_examples, data = fit_fold, len(X), data or (X, Y)
+        kwargs = {"generator": None, "pipeline": pipeline}
+    else:
+        fit, n_examples, data = fit_noise_fold, len(sampler), data or sampler
+        # the same augmentation pipeline as the FGSM condition
+        kwargs = {"pipeline": pipeline}
 
-data = hkl.load("data.hkl")
+    scheduler = FoldScheduler(n_workers)
+    scheduler.run(
+        fit,
+        data,
+        fold_indices(n_examples, n_splits=10) if folds is None else folds,
+        is_done=is_done,
+        on_done=on_done,
+        slice_data=sampler is None,
+        instance=resnet,
+        epochs=50,
+        BS=BS,
+        optimizer=tf.keras.optimizers.serialize(sgd),
+        callbacks_list=[lrate],
+        telemetry_file=telemetry_path(model_name),
+        **kwargs
+    )
 
-X_train, X_test, Y_train, y_test = (
-    data["xtrain"],
-    data["xtest"],
-    data["ytrain"],
-    data["ytest"],
-)
 
-for folder in folder_list:
-    experiments(X_train, Y_train, folder)
+if __name__ == "__main__":
+
+    for folder in folder_list:
+        os.makedirs(folder, exist_ok=True)
+
+    # int8 class indices, the models compile with the sparse cross-entropy
+    # person-grouped test part and folds, shared with the other scripts
+    data, folds = load_folds(sparse=True)
+
+    X_train, X_test, Y_train, y_test = (
+        data["xtrain"],
+        data["xtest"],
+        data["ytrain"],
+        data["ytest"],
+    )
+
+    # the adversarial examples are crafted against the baseline ResNet
+    source_model = load_model(
+        SOURCE_MODEL, "ResNet", (32, 32, 1), 0.0001, 0.9, nb_classes=4, N=2, k=1
+    )
+
+    for folder in folder_list:
+        experiments(
+            X_train,
+            Y_train,
+            folder,
+            source_model=source_model,
+            folds=folds,
+            data=load_training_data,
+        )
@@ -5,11 +5,24 @@ from sklearn.model_selection import KFold
 import sys
 import tensorflow
 import tensorflow as tf
-from multiprocessing import Pool
+import os
+import time
+from tensorflow.keras.optimizers import SGD
 
-from _utility import lrate, get_adversarial_examples, print_test, step_decay
-import hickle as hkl
+from _utility import (
+    lrate,
+    get_adversarial_examples,
+    loss_for,
+    print_test,
+    step_decay,
+    to_class_indices,
+)
+from person_store import open_store
+from fold_scheduler import FoldScheduler
+from telemetry import Telemetry, telemetry_path
+from wresnet import WideResidualNetwork
 import pickle
+from augmentation import augmentation_layers, image_data_generator, training_flow
 
 model_name = "ResNet_da"
 
@@ -25,14 +38,28 @@ class AdversarialTraining(object):
         self.epochs = parameter["epochs"]
         self.batch_size = parameter["batch_size"]
         self.optimizer = parameter["optimizer"]
+        # run the whole step (attack, augmentation, update) as one tf.function
+        self.compiled = parameter.get("compiled", False)
 
-        self.generator = tf.keras.preprocessing.image.ImageDataGenerator(
-            rotation_range=10,
-            width_shift_range=5.0 / 32,
-            height_shift_range=5.0 / 32,
-        )
+        # "generator" or "tf.data" augmentation of the per-batch fit
+        self.pipeline = parameter.get("pipeline", "generator")
+
+        self.augmentation = augmentation_layers()
+        self.generator = image_data_generator()
+
+    def train(self, model, train_dataset, val_dataset, epsilon_list, telemetry=None):
+        """[summary]
+
+        Args:
+            telemetry (Telemetry, optional): log of the attack and fit time of every
+                epoch. Defaults to None, nothing is written.
+        """
+        telemetry = telemetry or Telemetry()
 
-    def train(self, model, train_dataset, val_dataset, epsilon_list):
+        if self.compiled:
+            return self.train_compiled(
+                model, train_dataset, val_dataset, epsilon_list, telemetry
+            )
 
         # Ten fold cross validation
         for epoch in range(self.epochs):
@@ -41,12 +68,197 @@ class AdversarialTraining(object):
 
             for step, (x_train, y_train) in enumerate(train_dataset):
                 print(step)
-                x_train = self.data_augmentation(x_train, y_train, model, epsilon_list)
-                model.fit(
-                    self.generator.flow(x_train, y_train, self.batch_size),
-                    batch_size=self.batch_size,
-                    verbose=0.0,
+                with telemetry.phase("attack"):
+                    x_train, y_train = self.data_augmentation(
+                        x_train, y_train, model, epsilon_list
+                    )
+                with telemetry.phase("fit"):
+                    model.fit(
+                        training_flow(
+                            x_train,
+                            y_train,
+                            self.batch_size,
+                            self.pipeline,
+                            self.generator,
+                            repeat=False,
+                        ),
+                        batch_size=self.batch_size,
+                        verbose=0.0,
+                    )
+                telemetry.count(len(x_train))
+            telemetry.record("epoch", epoch=epoch)
+
+    def train_compiled(
+        self, model, train_dataset, val_dataset, epsilon_list, telemetry=None
+    ):
+        """[summary]
+
+        Args:
+            model ([type]): compiled model
+            train_dataset ([type]): batched tf.data training dataset
+            val_dataset ([type]): batched tf.data validation dataset
+            epsilon_list ([type]): epsilon of every adversarial input, according to SNR
+            telemetry (Telemetry, optional): log of the step and validation time of
+                every epoch. The attack runs inside train_step, its share is an
+                estimate from timing the attack alone once. Defaults to None,
+                nothing is written.
+
+        Returns:
+            history: loss and accuracy of every epoch on training and validation data
+        """
+        # int8 class indices or one-hot labels
+        sparse = train_dataset.element_spec[1].shape.rank == 1
+        loss_metric = tf.keras.metrics.Mean()
+        if sparse:
+            acc_metric = tf.keras.metrics.SparseCategoricalAccuracy()
+        else:
+            acc_metric = tf.keras.metrics.CategoricalAccuracy()
+        train_step = self.compiled_train_step(
+            model, epsilon_list, loss_metric, acc_metric, sparse
+        )
+        history = {"loss": [], "acc": [], "val_loss": [], "val_acc": []}
+        telemetry = telemetry or Telemetry()
+        with telemetry.phase("attack_measurement"):
+            attack_seconds = self.attack_seconds(model, train_dataset, epsilon_list)
+
+        for epoch in range(self.epochs):
+            lr_rate = step_decay(epoch)
+            tf.keras.backend.set_value(model.optimizer.learning_rate, lr_rate)
+            loss_metric.reset_states()
+            acc_metric.reset_states()
+
+            steps = 0
+            with telemetry.phase("train_step"):
+                for x_train, y_train in train_dataset:
+                    train_step(x_train, y_train)
+                    telemetry.count(int(x_train.shape[0]))
+                    steps += 1
+                # waits for the last dispatched step
+                history["loss"].append(float(loss_metric.result()))
+                history["acc"].append(float(acc_metric.result()))
+
+            with telemetry.phase("validation"):
+                val_loss, val_acc = model.evaluate(val_dataset, verbose=0)
+            history["val_loss"].append(val_loss)
+            history["val_acc"].append(val_acc)
+            last = {key: values[-1] for key, values in history.items()}
+            telemetry.record(
+                "epoch",
+                epoch=epoch,
+                # train_step includes the attack, this is its estimated share
+                attack_seconds_estimate=attack_seconds * steps,
+                **last
+            )
+            print(
+                "epoch {}: loss: {:.4f} - acc: {:.4f} - "
+                "val_loss: {:.4f} - val_acc: {:.4f}".format(
+                    epoch + 1,
+                    history["loss"][-1],
+                    history["acc"][-1],
+                    val_loss,
+                    val_acc,
                 )
+            )
+
+        return history
+
+    def compiled_train_step(
+        self, model, epsilon_list, loss_metric, acc_metric, sparse=False
+    ):
+        """[summary]
+
+        Args:
+            model ([type]): compiled model
+            epsilon_list ([type]): epsilon of every adversarial input
+            loss_metric ([type]): running mean of the training loss
+            acc_metric ([type]): running training accuracy
+            sparse (bool, optional): the labels are class indices. Defaults to False.
+
+        Returns:
+            tf.function which replaces the second half of the batch with adversarial
+            examples, augments the batch and applies one optimizer step.
+        """
+        epsilon_list = tf.constant(epsilon_list, dtype=tf.float32)
+        if sparse:
+            loss_fn = tf.keras.losses.SparseCategoricalCrossentropy()
+        else:
+            loss_fn = tf.keras.losses.CategoricalCrossentropy()
+
+        @tf.function
+        def train_step(x_batch, y_batch):
+            x_batch = tf.cast(x_batch, tf.float32)
+            first_half_end = tf.shape(x_batch)[0] // 2
+            x_adv = self.in_graph_adversarial_example(
+                model,
+                x_batch[first_half_end:],
+                y_batch[first_half_end:],
+                epsilon_list,
+            )
+            x_mix = tf.concat([x_batch[:first_half_end], x_adv], axis=0)
+            x_mix = self.augmentation(x_mix, training=True)
+
+            with tf.GradientTape() as tape:
+                y_pred = model(x_mix, training=True)
+                loss = loss_fn(y_batch, y_pred)
+                if model.losses:
+                    loss += tf.add_n(model.losses)
+
+            gradients = tape.gradient(loss, model.trainable_variables)
+            model.optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+            loss_metric.update_state(loss)
+            acc_metric.update_state(y_batch, y_pred)
+
+        return train_step
+
+    def attack_seconds(self, model, train_dataset, epsilon_list):
+        """seconds of the in-graph attack of one compiled training step, timed alone
+        on the first batch after a traced warm-up call"""
+        epsilon_list = tf.constant(epsilon_list, dtype=tf.float32)
+
+        @tf.function
+        def attack_step(x_batch, y_batch):
+            x_batch = tf.cast(x_batch, tf.float32)
+            first_half_end = tf.shape(x_batch)[0] // 2
+            return self.in_graph_adversarial_example(
+                model,
+                x_batch[first_half_end:],
+                y_batch[first_half_end:],
+                epsilon_list,
+            )
+
+        x_batch, y_batch = next(iter(train_dataset))
+        attack_step(x_batch, y_batch).numpy()
+        start = time.perf_counter()
+        attack_step(x_batch, y_batch).numpy()
+        return time.perf_counter() - start
+
+    def in_graph_adversarial_example(self, logits_model, X_true, y_true, epsilon_list):
+        """[summary]
+
+        Args:
+            logits_model ([type]): model which is attacked
+            X_true ([type]): clean inputs
+            y_true ([type]): one-hot outputs or class indices
+            epsilon_list ([type]): epsilon tensor, one value per input
+
+        Returns:
+            fast gradient sign examples built from graph ops only, so that they can
+            run inside the compiled training step. Same loss as the CleverHans attack.
+        """
+        epsilon = tf.reshape(epsilon_list[: tf.shape(X_true)[0]], (-1, 1, 1, 1))
+        if y_true.shape.rank > 1:
+            original_label = tf.argmax(y_true, axis=-1)
+        else:
+            original_label = tf.cast(y_true, tf.int64)
+
+        with tf.GradientTape() as tape:
+            tape.watch(X_true)
+            loss = tf.nn.sparse_softmax_cross_entropy_with_logits(
+                labels=original_label, logits=logits_model(X_true)
+            )
+        gradient = tape.gradient(loss, X_true)
+
+        return tf.stop_gradient(X_true + epsilon * tf.sign(gradient))
 
     def data_augmentation(self, X_train, Y_train, pretrained_model, epsilon_list):
         """[summary]
@@ -96,71 +308,145 @@ class AdversarialTraining(object):
         return self.adversarial_example(logits_model, X_true, y_true, epsilon_list)
 
     def adversarial_example(self, logits_model, X_true, y_true, epsilon_list):
-        X_adv = []
-
-        for index, x_true in enumerate(X_true):
-            epsilon = epsilon_list[index]
-
-            original_image = x_true
-            original_image = tf.reshape(original_image, (1, 32, 32))
-            original_label = y_true[index]
-            original_label = np.reshape(np.argmax(original_label), (1,)).astype("int64")
-            adv_example_targeted_label = fast_gradient_method(
-                logits_model,
-                original_image,
-                epsilon,
-                np.inf,
-                y=original_label,
-                targeted=False,
-            )
-            X_adv.append(np.array(adv_example_targeted_label).reshape(32, 32, 1))
-        X_adv = np.array(X_adv)
+        """[summary]
 
-        return X_adv
+        Args:
+            logits_model ([type]): model which is attacked
+            X_true ([type]): clean inputs
+            y_true ([type]): outputs
+            epsilon_list ([type]): epsilon of every input, according to SNR
 
+        Returns:
+            adversarial examples of the whole input batch, crafted in one call.
+            The epsilon of each input is broadcast against its gradient sign.
+        """
+        X_true = tf.cast(X_true, tf.float32)
+        epsilon = self.per_example_epsilon(epsilon_list, len(X_true), len(X_true.shape))
+        original_label = to_class_indices(y_true)
 
-def simulate_train(s):
+        X_adv = fast_gradient_method(
+            logits_model,
+            X_true,
+            epsilon,
+            np.inf,
+            y=original_label,
+            targeted=False,
+        )
 
-    for j, (train, val) in enumerate(kfold.split(X_train)):
-        if j == s:
-            print(s)
-            model = wideresnet.create_wide_residual_network()
-            model.compile(
-                loss="categorical_crossentropy", optimizer=sgd, metrics=["acc"]
-            )
-            print("Finished compiling")
-            x_train, y_train = X_train[train], Y_train[train]
-            x_val, y_val = X_train[val], Y_train[val]
-            train_dataset = tf.data.Dataset.from_tensor_slices((x_train, y_train))
-            train_dataset = train_dataset.batch(BS)
-            val_dataset = tf.data.Dataset.from_tensor_slices((x_val, y_val))
-            val_dataset = val_dataset.batch(BS)
-            adversarial_training.train(model, train_dataset, val_dataset, epsilons)
-            name = model_name + "_" + str(j) + ".h5"
-            model.save_weights(name)
+        return np.array(X_adv)
+
+    def per_example_epsilon(self, epsilon_list, batch_size, rank):
+        """[summary]
+
+        Args:
+            epsilon_list ([type]): epsilon values, one per input
+            batch_size ([type]): number of inputs
+            rank ([type]): rank of the input batch
+
+        Returns:
+            epsilon tensor of shape (batch_size, 1, ..., 1)
+        """
+        epsilon = tf.constant(epsilon_list[:batch_size], dtype=tf.float32)
+        return tf.reshape(epsilon, (-1,) + (1,) * (rank - 1))
+
+
+def fit_fold(j, x_train, y_train, x_val, y_val, instance, parameter, epsilon_list):
+    """adversarial training of the model of one fold
+
+    Returns:
+        history: training history of the compiled mode, None otherwise
+        weights: weights of the trained model
+    """
+    telemetry_file = parameter.get("telemetry_file")
+    telemetry = Telemetry(telemetry_file, fold=j)
+    with telemetry.phase("build"):
+        model = instance.create_wide_residual_network()
+        model.compile(
+            loss=loss_for(y_train),
+            optimizer=tf.keras.optimizers.get(parameter["optimizer"]),
+            metrics=["acc"],
+        )
+    print("Finished compiling")
+    BS = parameter["batch_size"]
+    train_dataset = tf.data.Dataset.from_tensor_slices((x_train, y_train))
+    train_dataset = train_dataset.batch(BS)
+    val_dataset = tf.data.Dataset.from_tensor_slices((x_val, y_val))
+    val_dataset = val_dataset.batch(BS)
+    adversarial_training = AdversarialTraining(parameter)
+    with telemetry.phase("fit"):
+        history = adversarial_training.train(
+            model,
+            train_dataset,
+            val_dataset,
+            epsilon_list,
+            telemetry=Telemetry(telemetry_file, fold=j),
+        )
+    telemetry.count(parameter["epochs"] * len(x_train))
+    telemetry.record("fold", epochs=parameter["epochs"])
+
+    return history, model.get_weights()
+
+
+def load_training_data():
+    # int8 class indices, the models compile with the sparse cross-entropy
+    data = open_store().load_split(("train",), sparse=True)
+    return data["xtrain"], data["ytrain"]
 
 
 if __name__ == "__main__":
 
-    data = hkl.load("data.hkl")
-    X_train, X_test, Y_train, y_test = (
-        data["xtrain"],
-        data["xtest"],
-        data["ytrain"],
-        data["ytest"],
-    )
+    X_train, Y_train = load_training_data()
+    # person-grouped folds of the stored split, shared with the other scripts
+    store = open_store()
+    folds = store.fold_indices(store.split())
     epsilons = [i / 1000 for i in range(1, 33)]  # factor for fast gradient sign method
 
-    kfold = KFold(n_splits=10, random_state=42, shuffle=False)
     EPOCHS = 50
     BS = 64
     init = (32, 32, 1)
     sgd = SGD(lr=0.1, momentum=0.9)
-    parameter = {"epochs": EPOCHS, "batch_size": BS, "optimizer": sgd}
+    parameter = {
+        "epochs": EPOCHS,
+        "batch_size": BS,
+        "optimizer": tf.keras.optimizers.serialize(sgd),
+        "compiled": True,
+        # per-epoch and per-fold wall time, throughput and peak memory
+        "telemetry_file": telemetry_path("history_" + model_name),
+    }
+    # bfloat16 convolutions on CPUs with bf16 instructions
+    MIXED_PRECISION = False
     # change here depending on your model
     wideresnet = WideResidualNetwork(
-        init, 0.0001, 0.9, nb_classes=4, N=2, k=1, dropout=0.0
+        init,
+        0.0001,
+        0.9,
+        nb_classes=4,
+        N=2,
+        k=1,
+        dropout=0.0,
+        mixed_precision=MIXED_PRECISION,
     )
 
-    with Pool(10) as p:
-        print(p.map(f, np.range(10)))
+    def is_done(j):
+        return os.path.exists(model_name + "_" + str(j) + ".h5")
+
+    def on_done(j, history, weights):
+        if history is not None:
+            with open("history_" + model_name + str(j), "wb") as file_pi:
+                pickle.dump(history, file_pi)
+        model = wideresnet.create_wide_residual_network()
+        model.set_weights(weights)
+        model.save_weights(model_name + "_" + str(j) + ".h5")
+
+    # every fold in its own process, with the cores shared between them
+    scheduler = FoldScheduler(n_workers=10)
+    scheduler.run(
+        fit_fold,
+        load_training_data,
+        folds,
+        is_done=is_done,
+        on_done=on_done,
+        instance=wideresnet,
+        parameter=parameter,
+        epsilon_list=epsilons,
+    )
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from _utility import get_fgsm_sweep
+from prediction_cache import array_hash, weights_hash
+
+STORE_DIR = ".ae_store"
+
+
+class AEStore(object):
+    """
+    Memory-mapped FGSM examples of a whole input, one .npy file per source model,
+    input and epsilon. The adversarial examples of the first n inputs are the
+    first n rows, so every subset of a percent of the input is a prefix slice of
+    the stored array and does not need an attack of its own.
+    """
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self._input_hashes = {}
+
+    def key(self, weights_path, X, epsilon):
+        """returns the file name of the examples of a source model, input and epsilon"""
+        input_hash = self._input_hashes.get(id(X))
+        if input_hash is None or input_hash[0] is not X:
+            input_hash = (X, array_hash(X))
+            self._input_hashes[id(X)] = input_hash
+        digest = hashlib.sha256(
+            "{}:{}:fgsm:{!r}".format(
+                weights_hash(weights_path), input_hash[1], float(epsilon)
+            ).encode()
+        )
+        return digest.hexdigest()[:32]
+
+    def examples(self, source_model, weights_path, X, Y, epsilon):
+        """[summary]
+
+        Args:
+            source_model (Model): attacked model holding the weights of weights_path,
+                only used when the examples are not stored yet
+            weights_path (str): weights file of the source model
+            X ([type]): clean inputs
+            Y ([type]): one-hot labels or class indices
+            epsilon (float): perturbation size
+
+        Returns:
+            read-only memmap of the adversarial examples of all of X
+        """
+        path = os.path.join(self.store_dir, self.key(weights_path, X, epsilon))
+        if not os.path.exists(path + ".npy"):
+            os.makedirs(self.store_dir, exist_ok=True)
+            # the gradient sign is shared by the epsilons of the same source model
+            sweep = get_fgsm_sweep(source_model, X, Y)
+            tmp = path + ".{}.tmp.npy".format(os.getpid())
+            out = np.lib.format.open_memmap(
+                tmp, mode="w+", dtype="float32", shape=sweep.sign.shape
+            )
+            sweep.examples(epsilon, out=out)
+            out.flush()
+            del out
+            os.replace(tmp, path + ".npy")
+            with open(path + ".json", "w") as file_:
+                json.dump({"weights": weights_path, "epsilon": epsilon}, file_)
+
+        return np.load(path + ".npy", mmap_mode="r")
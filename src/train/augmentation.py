@@ -0,0 +1,268 @@
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.keras.layers.experimental.preprocessing import (
+    RandomRotation,
+    RandomTranslation,
+)
+
+# settings of the ImageDataGenerator used by every training script
+ROTATION_RANGE = 10
+WIDTH_SHIFT_RANGE = 5.0 / 32
+HEIGHT_SHIFT_RANGE = 5.0 / 32
+
+PIPELINES = ("generator", "tf.data")
+
+
+def image_data_generator():
+    """returns the ImageDataGenerator of the training scripts"""
+    return tf.keras.preprocessing.image.ImageDataGenerator(
+        rotation_range=ROTATION_RANGE,
+        width_shift_range=WIDTH_SHIFT_RANGE,
+        height_shift_range=HEIGHT_SHIFT_RANGE,
+    )
+
+
+def augmentation_layers():
+    """random rotation and shift of the ImageDataGenerator as batched tensor ops
+
+    Returns:
+        Sequential: model which augments a whole batch when called with training=True
+    """
+    return tf.keras.Sequential(
+        [
+            RandomRotation(ROTATION_RANGE / 360.0, fill_mode="nearest"),
+            RandomTranslation(
+                HEIGHT_SHIFT_RANGE, WIDTH_SHIFT_RANGE, fill_mode="nearest"
+            ),
+        ]
+    )
+
+
+def augmented_dataset(X, Y, batch_size, repeat=True, seed=None):
+    """[summary]
+
+    Args:
+        X ([type]): training inputs
+        Y ([type]): outputs
+        batch_size (int): batch size
+        repeat (bool, optional): repeat forever like ImageDataGenerator.flow, so
+            that steps_per_epoch can be used. Defaults to True.
+        seed (int, optional): shuffle seed. Defaults to None.
+
+    Returns:
+        tf.data.Dataset: shuffled and augmented batches, augmented in parallel
+        map calls and prefetched
+    """
+    augmentation = augmentation_layers()
+
+    dataset = tf.data.Dataset.from_tensor_slices((X, Y))
+    dataset = dataset.shuffle(len(X), seed=seed, reshuffle_each_iteration=True)
+    if repeat:
+        dataset = dataset.repeat()
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(
+        lambda x, y: (augmentation(x, training=True), y),
+        num_parallel_calls=tf.data.experimental.AUTOTUNE,
+    )
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
+class NoiseSampler(object):
+    """
+    Clean inputs followed by random-noise copies of the first percent of them,
+    built inside the input pipeline instead of stored in a second array.
+
+    The examples have virtual indices: i < len(X) is the clean X[i], i >= len(X)
+    is X[i - len(X)] plus float32 noise drawn from a stateless RNG seeded with
+    (seed, i). Any fold, batch order or rerun therefore sees the same noise for
+    the same index.
+
+    Args:
+        X ([type]): clean inputs
+        Y ([type]): outputs
+        percent (float): perturbed fraction of X, a prefix like the FGSM subsets
+        epsilon (float): radius of the noise ball
+        order (optional): np.inf for uniform noise in the L-inf ball, 2 for the
+            L2 ball. Defaults to np.inf.
+        seed (int, optional): Defaults to 0.
+    """
+
+    def __init__(self, X, Y, percent, epsilon, order=np.inf, seed=0):
+        if order not in (np.inf, 2):
+            raise NotImplementedError(order)
+        self.X = X
+        self.Y = Y
+        self.split = int(len(X) * percent)
+        self.epsilon = epsilon
+        self.order = order
+        self.seed = seed
+        self._tensors = None
+
+    def __len__(self):
+        return len(self.X) + self.split
+
+    def __getstate__(self):
+        # the tensors are rebuilt in the worker processes
+        state = dict(self.__dict__)
+        state["_tensors"] = None
+        return state
+
+    def perturbation(self, index, shape):
+        """float32 noise of one virtual index"""
+        seed = tf.stack([tf.constant(self.seed, tf.int64), index])
+        if self.order == np.inf:
+            return tf.random.stateless_uniform(
+                shape, seed, minval=-self.epsilon, maxval=self.epsilon
+            )
+        direction_seed, radius_seed = tf.unstack(
+            tf.random.experimental.stateless_split(seed, 2)
+        )
+        direction = tf.math.l2_normalize(
+            tf.random.stateless_normal(shape, direction_seed)
+        )
+        dim = tf.cast(tf.reduce_prod(shape), tf.float32)
+        radius = tf.random.stateless_uniform([], radius_seed) ** (1.0 / dim)
+        return self.epsilon * radius * direction
+
+    def clean_tensors(self):
+        """one float32 copy of the clean data, shared by every fold and epoch of
+        this process"""
+        if self._tensors is None:
+            self._tensors = (
+                tf.convert_to_tensor(np.asarray(self.X, dtype="float32")),
+                tf.convert_to_tensor(np.asarray(self.Y)),
+            )
+        return self._tensors
+
+    def example(self, index):
+        """(x, y) of one virtual index"""
+        X, Y = self._tensors
+        n_clean = len(self.X)
+
+        source = tf.where(index < n_clean, index, index - n_clean)
+        x = tf.gather(X, source)
+        if self.split:
+            x = tf.cond(
+                index < n_clean,
+                lambda: x,
+                lambda: x + self.perturbation(index, tf.shape(x)),
+            )
+        return x, tf.gather(Y, source)
+
+    def dataset(self, index, batch_size):
+        """returns the batches of virtual indices, in order"""
+        self.clean_tensors()
+        dataset = tf.data.Dataset.from_tensor_slices(np.asarray(index, dtype="int64"))
+        dataset = dataset.map(
+            self.example, num_parallel_calls=tf.data.experimental.AUTOTUNE
+        )
+        return dataset.batch(batch_size)
+
+    def arrays(self, index, batch_size=256):
+        """returns the examples of virtual indices as arrays, e.g. validation data"""
+        x, y = [], []
+        for x_batch, y_batch in self.dataset(index, batch_size):
+            x.append(x_batch.numpy())
+            y.append(y_batch.numpy())
+        return np.concatenate(x), np.concatenate(y)
+
+    def training_dataset(
+        self,
+        index,
+        batch_size,
+        repeat=True,
+        seed=None,
+        pipeline="generator",
+        generator=None,
+    ):
+        """[summary]
+
+        Args:
+            index ([type]): virtual indices of the training examples
+            batch_size (int): batch size
+            repeat (bool, optional): see augmented_dataset. Defaults to True.
+            seed (int, optional): shuffle seed. Defaults to None.
+            pipeline (str, optional): augmentation of the noised batches as in
+                training_flow, "generator" or "tf.data". Defaults to "generator".
+            generator (ImageDataGenerator, optional): generator of the "generator"
+                pipeline. Defaults to image_data_generator().
+
+        Raises:
+            ValueError: unknown pipeline
+
+        Returns:
+            shuffled, noised and augmented batches, the noise is added before the
+            augmentation. A tf.data.Dataset as augmented_dataset for "tf.data", a
+            generator of ImageDataGenerator batches for "generator"
+        """
+        if pipeline not in PIPELINES:
+            raise ValueError(
+                "Unknown augmentation pipeline {}, expected one of {}".format(
+                    pipeline, PIPELINES
+                )
+            )
+        self.clean_tensors()
+
+        dataset = tf.data.Dataset.from_tensor_slices(np.asarray(index, dtype="int64"))
+        dataset = dataset.shuffle(len(index), seed=seed, reshuffle_each_iteration=True)
+        if repeat:
+            dataset = dataset.repeat()
+        dataset = dataset.map(
+            self.example, num_parallel_calls=tf.data.experimental.AUTOTUNE
+        )
+        dataset = dataset.batch(batch_size)
+
+        if pipeline == "generator":
+            return generator_batches(
+                dataset.prefetch(tf.data.experimental.AUTOTUNE),
+                generator or image_data_generator(),
+            )
+
+        augmentation = augmentation_layers()
+        dataset = dataset.map(
+            lambda x, y: (augmentation(x, training=True), y),
+            num_parallel_calls=tf.data.experimental.AUTOTUNE,
+        )
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
+def generator_batches(dataset, generator):
+    """yields the batches of a dataset with the random transforms of an
+    ImageDataGenerator applied, the transforms of ImageDataGenerator.flow
+    """
+    for x, y in dataset:
+        x, y = x.numpy(), y.numpy()
+        yield next(generator.flow(x, y, batch_size=len(x), shuffle=False))
+
+
+def training_flow(X, Y, batch_size, pipeline="generator", generator=None, repeat=True):
+    """returns the augmented training input of model.fit
+
+    Args:
+        X ([type]): training inputs
+        Y ([type]): outputs
+        batch_size (int): batch size
+        pipeline (str, optional): "generator" for ImageDataGenerator.flow or
+            "tf.data" for augmented_dataset. Defaults to "generator".
+        generator (ImageDataGenerator, optional): generator of the "generator"
+            pipeline. Defaults to image_data_generator().
+        repeat (bool, optional): see augmented_dataset. Defaults to True.
+
+    Raises:
+        ValueError: unknown pipeline
+
+    Returns:
+        iterator or dataset of augmented batches
+    """
+    if pipeline == "generator":
+        generator = generator or image_data_generator()
+        return generator.flow(X, Y, batch_size=batch_size)
+    if pipeline == "tf.data":
+        return augmented_dataset(X, Y, batch_size, repeat=repeat)
+
+    raise ValueError(
+        "Unknown augmentation pipeline {}, expected one of {}".format(
+            pipeline, PIPELINES
+        )
+    )
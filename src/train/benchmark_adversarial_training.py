@@ -0,0 +1,127 @@
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.optimizers import SGD
+
+from adversarial_training import AdversarialTraining
+from augmentation import training_flow
+from wresnet import WideResidualNetwork
+
+BS = 64
+N_BATCHES = 50
+WARMUP_BATCHES = 5
+# epsilons of the adversarial_training main
+EPSILONS = [i / 1000 for i in range(1, 33)]
+
+
+def build_model():
+    model = WideResidualNetwork(
+        (32, 32, 1), 0.0001, 0.9, nb_classes=4, N=2, k=1, dropout=0.0, verbose=0
+    ).create_wide_residual_network()
+    model.compile(
+        loss="categorical_crossentropy",
+        optimizer=SGD(lr=0.1, momentum=0.9),
+        metrics=["acc"],
+    )
+    return model
+
+
+def per_batch_step(training, model):
+    """the loop body of AdversarialTraining.train without compiled: the cleverhans
+    attack of the second half of the batch and one model.fit call"""
+
+    def step(x_batch, y_batch):
+        x_batch, y_batch = training.data_augmentation(
+            x_batch, y_batch, model, EPSILONS
+        )
+        model.fit(
+            training_flow(
+                x_batch,
+                y_batch,
+                training.batch_size,
+                training.pipeline,
+                training.generator,
+                repeat=False,
+            ),
+            batch_size=training.batch_size,
+            verbose=0,
+        )
+
+    return step
+
+
+def compiled_step(training, model):
+    """the loop body of AdversarialTraining.train_compiled, the attack, the
+    augmentation and the update in one tf.function"""
+    train_step = training.compiled_train_step(
+        model,
+        EPSILONS,
+        tf.keras.metrics.Mean(),
+        tf.keras.metrics.CategoricalAccuracy(),
+    )
+
+    def step(x_batch, y_batch):
+        train_step(x_batch, y_batch)
+
+    return step
+
+
+def benchmark(compiled, X, Y, batch_size=BS, n_batches=N_BATCHES):
+    """[summary]
+
+    Args:
+        compiled (bool): compiled training step or the per-batch model.fit loop
+        X ([type]): inputs
+        Y ([type]): one-hot outputs
+        batch_size (int, optional): batch size. Defaults to BS.
+        n_batches (int, optional): timed batches. Defaults to N_BATCHES.
+
+    Returns:
+        images per second of the adversarial training
+    """
+    model = build_model()
+    training = AdversarialTraining(
+        {
+            "epochs": 1,
+            "batch_size": batch_size,
+            "optimizer": tf.keras.optimizers.serialize(SGD(lr=0.1, momentum=0.9)),
+            "compiled": compiled,
+        }
+    )
+    if compiled:
+        step = compiled_step(training, model)
+    else:
+        step = per_batch_step(training, model)
+
+    dataset = tf.data.Dataset.from_tensor_slices((X, Y)).batch(batch_size)
+    batches = iter(dataset.repeat())
+    for _ in range(WARMUP_BATCHES):
+        step(*next(batches))
+    # the dispatched steps finish before the timer starts and stops
+    model.get_weights()
+
+    start = time.perf_counter()
+    n_images = 0
+    for _ in range(n_batches):
+        x_batch, y_batch = next(batches)
+        step(x_batch, y_batch)
+        n_images += len(x_batch)
+    model.get_weights()
+
+    return n_images / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+
+    # same size and shape as the training split of data.pz
+    X = np.random.normal(size=(5440, 32, 32, 1)).astype("float32")
+    Y = np.eye(4, dtype="float32")[np.random.randint(4, size=len(X))]
+
+    tf.random.set_seed(0)
+    per_batch = benchmark(False, X, Y)
+    tf.random.set_seed(0)
+    compiled = benchmark(True, X, Y)
+    print("{:>10}: {:10.1f} images/sec".format("per-batch", per_batch))
+    print("{:>10}: {:10.1f} images/sec".format("compiled", compiled))
+    print("speedup: {:.1f}x".format(compiled / per_batch))
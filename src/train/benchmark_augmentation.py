@@ -0,0 +1,47 @@
+import time
+
+import numpy as np
+
+from augmentation import PIPELINES, training_flow
+
+BS = 64
+N_BATCHES = 200
+WARMUP_BATCHES = 10
+
+
+def benchmark(pipeline, X, Y, batch_size=BS, n_batches=N_BATCHES):
+    """[summary]
+
+    Args:
+        pipeline (str): augmentation pipeline, see training_flow
+        X ([type]): inputs
+        Y ([type]): outputs
+        batch_size (int, optional): batch size. Defaults to BS.
+        n_batches (int, optional): timed batches. Defaults to N_BATCHES.
+
+    Returns:
+        images per second of the pipeline
+    """
+    batches = iter(training_flow(X, Y, batch_size, pipeline=pipeline))
+    for _ in range(WARMUP_BATCHES):
+        next(batches)
+
+    start = time.perf_counter()
+    n_images = 0
+    for _ in range(n_batches):
+        x_batch, _ = next(batches)
+        n_images += len(x_batch)
+
+    return n_images / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+
+    # same size and shape as the training split of data.pz
+    X = np.random.normal(size=(5440, 32, 32, 1)).astype("float32")
+    Y = np.eye(4, dtype="float32")[np.random.randint(4, size=len(X))]
+
+    results = {pipeline: benchmark(pipeline, X, Y) for pipeline in PIPELINES}
+    for pipeline, images_per_second in results.items():
+        print("{:>10}: {:10.1f} images/sec".format(pipeline, images_per_second))
+    print("speedup: {:.1f}x".format(results["tf.data"] / results["generator"]))
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.optimizers import SGD
+
+from _utility import get_adversarial_examples
+from augmentation import training_flow
+from person_store import open_store
+from parsevalnet import ParsevalNetwork
+from wresnet import WideResidualNetwork
+
+BS = 64
+EPOCHS = 10
+WARMUP_BATCHES = 10
+EPSILON = 0.01
+
+ARCHITECTURES = {"ResNet": WideResidualNetwork, "Parseval": ParsevalNetwork}
+
+
+def benchmark(architecture, mixed_precision, data, epochs=EPOCHS, batch_size=BS):
+    """[summary]
+
+    Args:
+        architecture (str): key of ARCHITECTURES
+        mixed_precision (bool): bfloat16 convolutions
+        data (dict): split of PersonStore.load_split
+        epochs (int, optional): training epochs. Defaults to EPOCHS.
+        batch_size (int, optional): batch size. Defaults to BS.
+
+    Returns:
+        mean milliseconds per training step, clean and FGSM test accuracy
+    """
+    model = ARCHITECTURES[architecture](
+        (32, 32, 1),
+        0.0001,
+        0.9,
+        nb_classes=4,
+        N=2,
+        k=1,
+        dropout=0.0,
+        verbose=0,
+        mixed_precision=mixed_precision,
+    ).create_wide_residual_network()
+    model.compile(
+        loss="categorical_crossentropy",
+        optimizer=SGD(lr=0.1, momentum=0.9),
+        metrics=["acc"],
+    )
+
+    X_train, Y_train = data["xtrain"], data["ytrain"]
+    steps_per_epoch = len(X_train) // batch_size
+    batches = iter(training_flow(X_train, Y_train, batch_size, pipeline="tf.data"))
+    for _ in range(WARMUP_BATCHES):
+        model.train_on_batch(*next(batches))
+
+    elapsed = 0.0
+    for _ in range(epochs * steps_per_epoch):
+        x_batch, y_batch = next(batches)
+        start = time.perf_counter()
+        model.train_on_batch(x_batch, y_batch)
+        elapsed += time.perf_counter() - start
+
+    X_test, y_test = data["xtest"], data["ytest"]
+    _, clean_acc = model.evaluate(X_test, y_test, verbose=0)
+    X_adv = get_adversarial_examples(model, X_test, y_test, EPSILON)
+    _, adv_acc = model.evaluate(X_adv, y_test, verbose=0)
+
+    return 1000 * elapsed / (epochs * steps_per_epoch), clean_acc, adv_acc
+
+
+if __name__ == "__main__":
+
+    data = open_store().load_split(("train", "test"))
+    for architecture in ARCHITECTURES:
+        tf.random.set_seed(0)
+        np.random.seed(0)
+        float32 = benchmark(architecture, False, data)
+        tf.random.set_seed(0)
+        np.random.seed(0)
+        bfloat16 = benchmark(architecture, True, data)
+        for name, (step_ms, clean_acc, adv_acc) in (
+            ("float32", float32),
+            ("bfloat16", bfloat16),
+        ):
+            print(
+                "{:>8} {:>8}: {:7.2f} ms/step ({:4.2f}x) clean acc {:.4f} "
+                "FGSM({}) acc {:.4f}".format(
+                    architecture,
+                    name,
+                    step_ms,
+                    float32[0] / step_ms,
+                    clean_acc,
+                    EPSILON,
+                    adv_acc,
+                )
+            )
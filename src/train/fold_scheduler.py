@@ -0,0 +1,170 @@
+import multiprocessing
+import os
+
+import numpy as np
+from sklearn.model_selection import KFold
+
+# data of the fold workers, loaded once per worker process
+_worker_data = None
+# intra-op threads of a fold worker when the number of workers is not given
+THREADS_PER_WORKER = 2
+
+
+def default_workers(threads_per_worker=THREADS_PER_WORKER):
+    """number of fold workers which together use every core
+
+    Args:
+        threads_per_worker (int, optional): intra-op threads of every worker.
+            Defaults to THREADS_PER_WORKER.
+
+    Returns:
+        os.cpu_count() // threads_per_worker, at least 1
+    """
+    return max(1, (os.cpu_count() or 1) // threads_per_worker)
+
+
+def fold_indices(n_samples, n_splits=10):
+    """precomputes the train and validation indices of every fold
+
+    Args:
+        n_samples (int): number of examples
+        n_splits (int, optional): number of folds. Defaults to 10.
+
+    Returns:
+        list of (train, val) index arrays, same folds as KFold(shuffle=False)
+    """
+    kfold = KFold(n_splits=n_splits, shuffle=False)
+    return list(kfold.split(np.arange(n_samples)))
+
+
+def augmented_folds(folds, n_samples, n_augmented):
+    """extends folds of n_samples inputs to the inputs followed by augmented copies
+
+    Row n_samples + i of the augmented data is a copy of input i < n_augmented, as
+    in the FGSM and random-noise experiments. Every copy goes to the fold part of
+    its input, so a validation person is not trained on through its copies.
+
+    Returns:
+        list of (train, val) index arrays into the augmented data
+    """
+
+    def extend(index):
+        return np.concatenate([index, n_samples + index[index < n_augmented]])
+
+    return [(extend(train), extend(val)) for train, val in folds]
+
+
+class FoldScheduler(object):
+    """
+    Runs the folds of a cross validation in a pool of worker processes. Every worker
+    gets its own TensorFlow runtime with a bounded intra-op thread budget, so that
+    the folds together use every core of the machine. Folds whose results already
+    exist are skipped.
+    """
+
+    def __init__(self, n_workers=None, threads_per_worker=None):
+        """[summary]
+
+        Args:
+            n_workers (int, optional): worker processes, 1 trains the folds in this
+                process. Defaults to the cores // threads_per_worker.
+            threads_per_worker (int, optional): intra-op threads of every worker.
+                Defaults to cores // n_workers, or THREADS_PER_WORKER when
+                n_workers is not given either.
+        """
+        cores = os.cpu_count() or 1
+        if n_workers is None:
+            threads_per_worker = threads_per_worker or THREADS_PER_WORKER
+            n_workers = default_workers(threads_per_worker)
+        self.n_workers = n_workers
+        self.threads_per_worker = threads_per_worker or max(1, cores // self.n_workers)
+
+    def run(
+        self,
+        fit_fold,
+        data,
+        folds,
+        is_done=None,
+        on_done=None,
+        slice_data=True,
+        **kwargs
+    ):
+        """[summary]
+
+        Args:
+            fit_fold (callable): module level function
+                fit_fold(j, x_train, y_train, x_val, y_val, **kwargs) which trains one
+                fold and returns (history, weights)
+            data (tuple or callable): (X, Y) or a module level function returning
+                them, e.g. a memory-mapped cache loader, so that the workers share it.
+                It is loaded once per worker.
+            folds (list): (train, val) indices, see fold_indices
+            is_done (callable, optional): is_done(j) is True for finished folds.
+                Defaults to None.
+            on_done (callable, optional): on_done(j, history, weights) stores the
+                results of a fold in the parent process. Defaults to None.
+            slice_data (bool, optional): False calls
+                fit_fold(j, train, val, data, **kwargs) with the indices and the
+                loaded data instead, for data which is not an (X, Y) pair, e.g. an
+                augmentation.NoiseSampler. Defaults to True.
+
+        Returns:
+            results: dict of fold number to (history, weights) of the folds run now
+        """
+        tasks = [
+            (fit_fold, j, train, val, slice_data, kwargs)
+            for j, (train, val) in enumerate(folds)
+            if is_done is None or not is_done(j)
+        ]
+        results = {}
+        if not tasks:
+            return results
+
+        if self.n_workers == 1:
+            loaded = data() if callable(data) else data
+            for task in tasks:
+                j, history, weights = _fit(task, loaded)
+                if on_done is not None:
+                    on_done(j, history, weights)
+                results[j] = (history, weights)
+            return results
+
+        # spawn, a forked TensorFlow runtime is not usable in the child
+        context = multiprocessing.get_context("spawn")
+        n_workers = min(self.n_workers, len(tasks))
+        with context.Pool(
+            n_workers,
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, data),
+        ) as pool:
+            for j, history, weights in pool.imap_unordered(_run_fold, tasks):
+                if on_done is not None:
+                    on_done(j, history, weights)
+                results[j] = (history, weights)
+
+        return results
+
+
+def _init_worker(threads, data):
+    global _worker_data
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(min(2, threads))
+
+    _worker_data = data() if callable(data) else data
+
+
+def _run_fold(task):
+    return _fit(task, _worker_data)
+
+
+def _fit(task, data):
+    fit_fold, j, train, val, slice_data, kwargs = task
+    if slice_data:
+        X, Y = data
+        history, weights = fit_fold(j, X[train], Y[train], X[val], Y[val], **kwargs)
+    else:
+        history, weights = fit_fold(j, train, val, data, **kwargs)
+    return j, history, weights
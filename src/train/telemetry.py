@@ -0,0 +1,238 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import weakref
+
+import tensorflow as tf
+
+# seconds between two samples of the resident memory
+SAMPLE_INTERVAL = 0.05
+
+_memory_sampler = None
+
+
+def peak_rss_mb():
+    """peak resident memory of this process in MiB, the high-water mark of its
+    whole lifetime"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def current_rss_mb():
+    """current resident memory of this process in MiB, None without /proc"""
+    try:
+        with open("/proc/self/statm") as file_:
+            pages = int(file_.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+
+
+class MemorySampler(object):
+    """
+    Daemon thread which samples the resident memory of the process and keeps the
+    maximum of every registered Telemetry since its last record. One thread per
+    process, see memory_sampler.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.telemetries = weakref.WeakSet()
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+
+    def sample(self):
+        rss = current_rss_mb()
+        with self.lock:
+            for telemetry in list(self.telemetries):
+                telemetry.peak_rss = max(telemetry.peak_rss, rss)
+        return rss
+
+    def register(self, telemetry):
+        telemetry.peak_rss = current_rss_mb()
+        with self.lock:
+            self.telemetries.add(telemetry)
+
+    def reset(self, telemetry):
+        """returns the peak of a telemetry and starts its next window at the
+        current memory"""
+        rss = self.sample()
+        with self.lock:
+            peak = telemetry.peak_rss
+            telemetry.peak_rss = rss
+        return peak
+
+
+def memory_sampler():
+    """returns the MemorySampler of this process, None without /proc"""
+    global _memory_sampler
+    if _memory_sampler is None and current_rss_mb() is not None:
+        _memory_sampler = MemorySampler()
+    return _memory_sampler
+
+
+def telemetry_path(prefix):
+    """returns the telemetry log of the histories starting with prefix"""
+    return prefix + "_telemetry.jsonl"
+
+
+class Telemetry(object):
+    """
+    Wall time per phase, examples per second and peak memory, appended as json
+    lines to a log next to the history pickles. Every record carries the context,
+    e.g. the fold, and the phase times and the peak resident memory since the
+    previous record. Without /proc the peak is the high-water mark of the process.
+
+    Lines are written with a single append, so the fold workers can share a log.
+
+    Args:
+        filename (str, optional): jsonl log. Defaults to None, nothing is written.
+        **context: fields of every record, e.g. model and fold
+    """
+
+    def __init__(self, filename=None, **context):
+        self.filename = filename
+        self.context = context
+        self.phases = {}
+        self.examples = 0
+        self.started = time.perf_counter()
+        self.peak_rss = None
+        self.sampler = memory_sampler()
+        if self.sampler is not None:
+            self.sampler.register(self)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """adds the wall time of the block to the phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, n_examples):
+        """adds trained examples of the current record"""
+        self.examples += n_examples
+
+    def record(self, event, **fields):
+        """writes the phases, throughput and peak memory since the last record"""
+        elapsed = time.perf_counter() - self.started
+        timed = sum(self.phases.values())
+        if self.sampler is not None:
+            peak = self.sampler.reset(self)
+        else:
+            peak = peak_rss_mb()
+        record = dict(self.context)
+        record.update(fields)
+        record.update(
+            {
+                "event": event,
+                "time": time.time(),
+                "wall_seconds": elapsed,
+                "phase_seconds": dict(self.phases),
+                # time outside of the timed phases, e.g. python overhead
+                "other_seconds": max(elapsed - timed, 0.0),
+                "examples": self.examples,
+                "examples_per_second": self.examples / elapsed if elapsed else 0.0,
+                "peak_rss_mb": peak,
+            }
+        )
+        if self.filename is not None:
+            line = (json.dumps(record) + "\n").encode()
+            fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+        self.phases = {}
+        self.examples = 0
+        self.started = time.perf_counter()
+        return record
+
+
+class TelemetryCallback(tf.keras.callbacks.Callback):
+    """
+    Times the training steps and the validation of model.fit and writes one
+    record per epoch.
+
+    The kernel constraints, e.g. TightFrame, run inside the optimizer step. Their
+    share is estimated once per fold by timing one eager retraction of every
+    constraint, the sampled one for sample_rate < 1, divided by its
+    retraction_period and multiplied by the number of steps of every epoch.
+
+    Args:
+        telemetry (Telemetry): log of the records
+        batch_size (int): examples per training step
+    """
+
+    def __init__(self, telemetry, batch_size):
+        super(TelemetryCallback, self).__init__()
+        self.telemetry = telemetry
+        self.batch_size = batch_size
+        self.constraint_step_seconds = None
+
+    def on_train_begin(self, logs=None):
+        # a phase of its own, so the measurement is not counted as other_seconds
+        with self.telemetry.phase("constraint_measurement"):
+            self.constraint_step_seconds = self.constraint_seconds()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.steps = 0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.telemetry.add("train_step", time.perf_counter() - self.batch_start)
+        self.telemetry.count(self.batch_size)
+        self.steps += 1
+
+    def on_test_begin(self, logs=None):
+        self.test_start = time.perf_counter()
+
+    def on_test_end(self, logs=None):
+        self.telemetry.add("validation", time.perf_counter() - self.test_start)
+
+    def on_epoch_end(self, epoch, logs=None):
+        fields = {"epoch": epoch}
+        if self.constraint_step_seconds is not None:
+            fields["constraint_seconds_estimate"] = (
+                self.constraint_step_seconds * self.steps
+            )
+        fields.update({key: float(value) for key, value in (logs or {}).items()})
+        self.telemetry.record("epoch", **fields)
+
+    def constraint_seconds(self):
+        """mean seconds of the kernel constraints of the model per training step"""
+        layers = [
+            layer
+            for layer in self.model.layers
+            if getattr(layer, "kernel_constraint", None) is not None
+        ]
+        if not layers:
+            return None
+        seconds = 0.0
+        for layer in layers:
+            constraint = layer.kernel_constraint
+            start = time.perf_counter()
+            # retract does not advance the step counter of a periodic TightFrame
+            getattr(constraint, "retract", constraint)(layer.kernel).numpy()
+            # a periodic TightFrame retracts at every retraction_period-th step only
+            period = getattr(constraint, "retraction_period", 1)
+            seconds += (time.perf_counter() - start) / period
+        return seconds
@@ -1,7 +1,7 @@
 import numpy as np
 
 
-def noise(x, eps=0.3, order=np.inf, clip_min=None, clip_max=None):
+def noise(x, eps=0.3, order=np.inf, clip_min=None, clip_max=None, rng=None):
     """
     A weak attack that just picks a random point in the attacker's action
     space. When combined with an attack bundling function, this can be used to
@@ -16,12 +16,32 @@ def noise(x, eps=0.3, order=np.inf, clip_min=None, clip_max=None):
     ---------
     x : torch.Tensor
         The input image.
+    order : np.inf for uniform noise in the L-inf ball, 2 for uniform noise in the
+        L2 ball of every image
+    rng : np.random.RandomState, defaults to the global RNG
     """
+    rng = rng or np.random
+    x = np.asarray(x, dtype="float32")
 
-    if order != np.inf:
-        raise NotImplementedError(ord)
+    if order == np.inf:
+        eta = rng.uniform(low=-eps, high=eps, size=x.shape).astype("float32")
+    elif order == 2:
+        eta = l2_ball(rng, x.shape, eps)
+    else:
+        raise NotImplementedError(order)
 
-    eta = np.random.uniform(low=-eps, high=eps, size=x.shape)
     adv_x = x + eta
+    if clip_min is not None or clip_max is not None:
+        adv_x = np.clip(adv_x, clip_min, clip_max)
 
     return adv_x
+
+
+def l2_ball(rng, shape, eps):
+    """uniform samples of the L2 ball of radius eps, one per image of shape"""
+    direction = rng.normal(size=shape).astype("float32")
+    axes = tuple(range(1, len(shape)))
+    direction /= np.sqrt(np.sum(np.square(direction), axis=axes, keepdims=True))
+    dim = np.prod(shape[1:])
+    radius = eps * rng.uniform(size=(shape[0],) + (1,) * len(axes)) ** (1.0 / dim)
+    return direction * radius.astype("float32")
@@ -6,8 +6,12 @@ import sys
 import tensorflow
 import tensorflow as tf
 
-from _utility import print_test, get_adversarial_examples
+from _utility import print_test, get_adversarial_examples, loss_for
+from augmentation import training_flow
+from fold_scheduler import FoldScheduler, fold_indices
+from telemetry import Telemetry, TelemetryCallback, telemetry_path
 
+import os
 import pickle
 
 folder_name = "./adversarial_examples_parseval_net/src/logs/saved_models/"
@@ -25,32 +29,170 @@ def train(
     generator,
     callbacks_list,
     model_name="ResNet",
+    pipeline="generator",
+    n_workers=None,
+    data=None,
+    folds=None,
 ):
+    """ten fold cross validation of the network created by instance
 
-    kfold = KFold(n_splits=10, random_state=42, shuffle=False)
+    Args:
+        n_workers (int, optional): folds trained in parallel processes, 1 trains
+            them in this process. Defaults to default_workers().
+        data (callable, optional): module level loader of (X_train, Y_train) for the
+            worker processes, e.g. a memory-mapped cache. Defaults to the arrays.
+        folds (list, optional): (train, val) indices, e.g. the person-grouped folds
+            of person_store.load_folds. Defaults to ten KFold folds.
 
-    for j, (train, val) in enumerate(kfold.split(X_train)):
+    Folds whose history and model files already exist are skipped.
+    """
+    if folds is None:
+        folds = fold_indices(len(X_train), n_splits=10)
 
-        model = instance.create_wide_residual_network()
-        model.compile(loss="categorical_crossentropy", optimizer=sgd, metrics=["acc"])
+    def is_done(j):
+        return os.path.exists(history_path(model_name, j)) and os.path.exists(
+            model_path(model_name, j)
+        )
+
+    def on_done(j, history, weights):
+        save_fold(instance, model_name, j, history, weights)
+
+    scheduler = FoldScheduler(n_workers)
+    scheduler.run(
+        fit_fold,
+        data or (X_train, Y_train),
+        folds,
+        is_done=is_done,
+        on_done=on_done,
+        instance=instance,
+        epochs=epochs,
+        BS=BS,
+        optimizer=tf.keras.optimizers.serialize(sgd),
+        generator=generator,
+        callbacks_list=callbacks_list,
+        pipeline=pipeline,
+        telemetry_file=telemetry_path("history_" + model_name),
+    )
+
+
+def fit_fold(
+    j,
+    x_train,
+    y_train,
+    x_val,
+    y_val,
+    instance,
+    epochs,
+    BS,
+    optimizer,
+    generator,
+    callbacks_list,
+    pipeline,
+    telemetry_file=None,
+):
+    """trains the model of one fold
+
+    Args:
+        telemetry_file (str, optional): jsonl log of the epoch and fold telemetry.
+            Defaults to None.
 
-        print("Finished compiling")
+    Returns:
+        history: training history
+        weights: weights of the trained model
+    """
+    telemetry = Telemetry(telemetry_file, fold=j)
+    with telemetry.phase("build"):
+        model = instance.create_wide_residual_network()
+        model.compile(
+            loss=loss_for(y_train),
+            optimizer=tf.keras.optimizers.get(optimizer),
+            metrics=["acc"],
+        )
 
-        x_train, y_train = X_train[train], Y_train[train]
-        x_val, y_val = X_train[val], Y_train[val]
+    print("Finished compiling")
 
+    with telemetry.phase("fit"):
         hist = model.fit(
-            generator.flow(x_train, y_train, batch_size=BS),
+            training_flow(x_train, y_train, BS, pipeline, generator),
             steps_per_epoch=len(x_train) // BS,
             epochs=epochs,
-            callbacks=callbacks_list,
+            callbacks=callbacks_list
+            + [TelemetryCallback(Telemetry(telemetry_file, fold=j), BS)],
             validation_data=(x_val, y_val),
             validation_steps=x_val.shape[0] // BS,
         )
-        ## write the history
+    telemetry.count(epochs * (len(x_train) // BS) * BS)
+    telemetry.record("fold", epochs=epochs)
+
+    return hist.history, model.get_weights()
+
+
+def fit_noise_fold(
+    j,
+    train_index,
+    val_index,
+    sampler,
+    instance,
+    epochs,
+    BS,
+    optimizer,
+    callbacks_list,
+    pipeline="generator",
+    telemetry_file=None,
+):
+    """trains the model of one fold on the examples of an augmentation.NoiseSampler
+
+    Run by FoldScheduler.run with slice_data=False, train_index and val_index are
+    virtual indices of the sampler, which is loaded once per worker. The noised
+    examples are built in the tf.data pipeline of the sampler and augmented by
+    the pipeline of training_flow.
+
+    Returns:
+        history: training history
+        weights: weights of the trained model
+    """
+    telemetry = Telemetry(telemetry_file, fold=j)
+    with telemetry.phase("build"):
+        model = instance.create_wide_residual_network()
+        model.compile(
+            loss=loss_for(sampler.Y),
+            optimizer=tf.keras.optimizers.get(optimizer),
+            metrics=["acc"],
+        )
+
+    print("Finished compiling")
+
+    with telemetry.phase("validation_data"):
+        x_val, y_val = sampler.arrays(val_index)
+    with telemetry.phase("fit"):
+        hist = model.fit(
+            sampler.training_dataset(train_index, BS, seed=j, pipeline=pipeline),
+            steps_per_epoch=len(train_index) // BS,
+            epochs=epochs,
+            callbacks=callbacks_list
+            + [TelemetryCallback(Telemetry(telemetry_file, fold=j), BS)],
+            validation_data=(x_val, y_val),
+            validation_steps=len(val_index) // BS,
+        )
+    telemetry.count(epochs * (len(train_index) // BS) * BS)
+    telemetry.record("fold", epochs=epochs)
+
+    return hist.history, model.get_weights()
+
+
+def history_path(model_name, j):
+    return "history_" + model_name + str(j)
+
+
+def model_path(model_name, j):
+    return folder_name + model_name + "_" + str(j) + ".h5"
+
 
-        with open("history_" + model_name + str(j), "wb") as file_pi:
-            pickle.dump(hist.history, file_pi)
+def save_fold(instance, model_name, j, history, weights):
+    """writes the history and the model of a finished fold"""
+    with open(history_path(model_name, j), "wb") as file_pi:
+        pickle.dump(history, file_pi)
 
-        model_name = folder_name + model_name + "_" + str(j) + ".h5"
-        model.save(model_name)
+    model = instance.create_wide_residual_network()
+    model.set_weights(weights)
+    model.save(model_path(model_name, j))
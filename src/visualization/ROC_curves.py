@@ -22,9 +22,9 @@ warnings.filterwarnings("ignore")
 import tensorflow
 
 print("\nTensorflow Version: " + tf.__version__)
-from wresnet import WideResidualNetwork
-from parsevalnet import ParsevalNetwork
-import hickle as hkl
+from model_factory import load_model
+from prediction_cache import PredictionCache
+from person_store import open_store
 import os
 
 plt.rcParams.update({"font.size": 14})
@@ -32,12 +32,17 @@ plt.rcParams.update({"font.size": 14})
 prefix = ""
 
 
-def ROC_result(model):
+def ROC_result(architecture, model_path):
 
     fpr = dict()
     tpr = dict()
     roc_auc = dict()
-    y_score = model.predict(X_test)
+    # the model is only loaded when its predictions are not cached yet
+    y_score = cache.predict(
+        lambda: load_model(model_path, architecture, *WRN_ARGS, **WRN_KWARGS),
+        model_path,
+        X_test,
+    )
     # # Compute micro-average ROC curve and ROC area
     fpr["micro"], tpr["micro"], _ = roc_curve(y_test.ravel(), y_score.ravel())
     return fpr, tpr
@@ -155,8 +160,13 @@ def plot_roc(
 BS = 64
 init = (32, 32, 1)
 sgd = SGD(lr=0.1, momentum=0.9)
+# constructor arguments of the evaluated ResNet and Parseval networks
+WRN_ARGS = (init, 0.0001, 0.9)
+WRN_KWARGS = dict(nb_classes=4, N=2, k=1, dropout=0.0)
+cache = PredictionCache()
 
-data = hkl.load("data.hkl")
+# the stored person-grouped split, the test persons are never trained on
+data = open_store().load_split(("train", "test"))
 X_train, X_test, Y_train, y_test = (
     data["xtrain"],
     data["xtest"],
@@ -184,17 +194,10 @@ for exp in Experiment:
             micro_roc_auc = []
             fpr_list, tpr_list, roc_auc_list = [], [], []
             for i in range(10):
-                resnet = WideResidualNetwork(
-                    init, 0.0001, 0.9, nb_classes=4, N=2, k=1, dropout=0.0
-                )
-                model = resnet.create_wide_residual_network()
-                model.compile(
-                    loss="categorical_crossentropy", optimizer=sgd, metrics=["acc"]
-                )
                 if percent != 0:
                     model_path = (
                         prefix
-                        + ex
+                        + exp
                         + "/ResNet_"
                         + str(epsilon)
                         + "_"
@@ -204,12 +207,10 @@ for exp in Experiment:
                         + ".h5"
                     )
                     print(model_path)
-                    model.load_weights(model_path)
                 else:
                     model_path = prefix + "ResNet/ResNet_" + str(i) + ".h5"
                     print(model_path)
-                    model.load_weights(model_path)
-                    fpr, tpr = ROC_result(model)
+                    fpr, tpr = ROC_result("ResNet", model_path)
                     tprs.append(interp(mean_fpr, fpr["micro"], tpr["micro"]))
                     roc_auc = auc(fpr["micro"], tpr["micro"])
                     aucs.append(roc_auc)
@@ -222,13 +223,8 @@ for exp in Experiment:
                         [],
                     )
 for i in range(10):
-    parseval = ParsevalNetwork(init, 0.0001, 0.9, nb_classes=4, N=2, k=1, dropout=0.0)
-
-    model = parseval.create_wide_residual_network()
-    model.compile(loss="categorical_crossentropy", optimizer=sgd, metrics=["acc"])
     model_name = prefix + "ResNet/Parseval_" + str(i) + ".h5"
-    model.load_weights(model_name)
-    fpr, tpr = ROC_result(model)
+    fpr, tpr = ROC_result("Parseval", model_name)
     parseval_micro_tpr.append(interp(mean_fpr, fpr["micro"], tpr["micro"]))
     roc_auc = auc(fpr["micro"], tpr["micro"])
     parseval_micro_roc_auc.append(roc_auc)
@@ -0,0 +1,37 @@
+import sys
+
+import pandas as pd
+from matplotlib import pyplot as plt
+
+plt.rcParams.update({"font.size": 14})
+
+
+def plot_orthogonality(filename, fig_name):
+    """plots the per-layer values written by OrthogonalityMonitor against the epoch
+
+    Args:
+        filename (str): csv file of OrthogonalityMonitor
+        fig_name (str): output figure
+    """
+    table = pd.read_csv(filename)
+    table = table[table["batch"].isna()]
+
+    fig, axes = plt.subplots(1, 2, figsize=(16, 6))
+    for layer, rows in table.groupby("layer"):
+        axes[0].plot(rows["epoch"], rows["spectral_norm"], label=layer)
+        axes[1].plot(rows["epoch"], rows["orthogonality_error"], label=layer)
+
+    axes[0].set_ylabel("Spectral Norm")
+    axes[1].set_ylabel("||W^T W - I||")
+    axes[1].set_yscale("log")
+    for ax in axes:
+        ax.set_xlabel("Epoch")
+    axes[1].legend(loc="best", fontsize=8)
+    plt.tight_layout()
+
+    plt.savefig(fig_name)
+
+
+if __name__ == "__main__":
+
+    plot_orthogonality(sys.argv[1], sys.argv[2])
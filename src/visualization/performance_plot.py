@@ -2,6 +2,8 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
+from model_factory import load_model
+from prediction_cache import PredictionCache
 
 plt.rcParams.update({"font.size": 14})
 ## add your path
@@ -19,6 +21,7 @@ def plot_figure(x_acc, x_size, y_err, title, epsilon, exp):
 
 
 Experiment = ["AEModels", "RandomNoisemodels"]
+cache = PredictionCache()
 
 
 for exp in Experiment:
@@ -32,15 +35,23 @@ for exp in Experiment:
             epsilon = file.split("_")[1]
             percent = file.split("_")[2]
             ModelID = file.split("_")[3].split(".")[0]
-            resnet = WideResidualNetwork(
-                init, 0.0001, 0.9, nb_classes=4, N=2, k=1, dropout=0.0
+            model_path = prefix + exp + "/" + file
+            acc = cache.evaluate(
+                lambda: load_model(
+                    model_path,
+                    "ResNet",
+                    init,
+                    0.0001,
+                    0.9,
+                    nb_classes=4,
+                    N=2,
+                    k=1,
+                    dropout=0.0,
+                ),
+                model_path,
+                X_test,
+                y_test,
             )
-            resnet_model = resnet.create_wide_residual_network()
-            resnet_model.compile(
-                loss="categorical_crossentropy", optimizer=sgd, metrics=["acc"]
-            )
-            resnet_model.load_weights(prefix + exp + "/" + file)
-            acc = resnet_model.evaluate(X_test, y_test)
 
             row = {
                 "Model_ID": ModelID,
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+tf = pytest.importorskip("tensorflow")
+pytest.importorskip("cleverhans")
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+for folder in (
+    "models",
+    "models/FullyConectedModels",
+    "models/Parseval_Networks",
+    "models/wideresnet",
+):
+    sys.path.insert(1, os.path.join(SRC, folder))
+
+from _utility import get_fgsm_sweep  # noqa: E402
+from model_factory import get_model, load_model  # noqa: E402
+
+
+def save_random_weights(path, seed):
+    model = get_model("CNN", 0.0001)
+    rng = np.random.RandomState(seed)
+    model.set_weights(
+        [
+            rng.normal(scale=0.1, size=w.shape).astype(w.dtype)
+            for w in model.get_weights()
+        ]
+    )
+    model.save_weights(path)
+
+
+def test_sweep_follows_the_loaded_weights(tmp_path):
+    first, second = str(tmp_path / "first.h5"), str(tmp_path / "second.h5")
+    save_random_weights(first, seed=0)
+    save_random_weights(second, seed=1)
+
+    rng = np.random.RandomState(2)
+    X = rng.uniform(size=(32, 32, 32, 1)).astype("float32")
+    y = rng.randint(0, 4, size=32).astype("int8")
+
+    model = load_model(first, "CNN", 0.0001)
+    sweep = get_fgsm_sweep(model, X, y)
+    sign_first = sweep.sign.copy()
+    # same weights and input, the gradient sign is reused
+    assert get_fgsm_sweep(model, X, y) is sweep
+
+    # the cached model of the architecture holds the second weights now
+    assert load_model(second, "CNN", 0.0001) is model
+    sign_second = get_fgsm_sweep(model, X, y).sign
+    assert not np.array_equal(sign_first, sign_second)
+
+    # weights loaded without load_model are detected by their fingerprint
+    model.load_weights(first)
+    np.testing.assert_array_equal(get_fgsm_sweep(model, X, y).sign, sign_first)